@@ -1,17 +1,21 @@
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Optional, AsyncIterator, Dict
 import os
+import json
+from datetime import datetime
 from dotenv import load_dotenv
 import uvicorn
 
-from services.document_service import DocumentService
+from services.document_service import DocumentService, DocumentTooLarge, DocumentBusy
 from services.qa_service import QAService
 from services.chat_service import ChatService
-from models.database import init_db
+from services.ingestion_service import IngestionQueueFull
+from services.registry import get_registry
 from utils.file_processor import FileProcessor
+from utils.upload_limit import UploadSizeLimitMiddleware
 
 # Load environment variables
 load_dotenv()
@@ -20,13 +24,16 @@ from contextlib import asynccontextmanager
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Initialize database and services on startup"""
-    await init_db()
+    """Initialize shared resources and services on startup"""
+    await registry.initialize()
     await document_service.initialize()
     await qa_service.initialize()
     await chat_service.initialize()
+    chat_service.start_cleanup()
     yield
-    # Cleanup code here if needed
+    await chat_service.shutdown()
+    await document_service.shutdown()
+    await registry.shutdown()
 
 app = FastAPI(
     title="SolveX AI",
@@ -35,6 +42,16 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Initialize services around one shared vector store, DB engine and OpenAI client
+registry = get_registry()
+document_service = DocumentService(registry)
+qa_service = QAService(document_service, registry)
+chat_service = ChatService(registry)
+file_processor = FileProcessor()
+
+# Refuse oversized uploads before Starlette parses and spools them (inside CORS, so browsers see the 413)
+app.add_middleware(UploadSizeLimitMiddleware, max_size=document_service.max_upload_size)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -44,12 +61,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize services
-document_service = DocumentService()
-qa_service = QAService()
-chat_service = ChatService()
-file_processor = FileProcessor()
-
 # Request/Response models
 class ChatMessage(BaseModel):
     message: str
@@ -63,12 +74,22 @@ class DocumentUploadResponse(BaseModel):
     document_id: str
     filename: str
     status: str
+    processed: str
     message: str
 
+class DocumentStatusResponse(BaseModel):
+    document_id: str
+    processed: str
+    chunks_embedded: Optional[int] = None
+    chunks_total: Optional[int] = None
+    chunks_reused: Optional[int] = None
+    error: Optional[str] = None
+
 class QAResponse(BaseModel):
     answer: str
     sources: List[str]
     confidence: float
+    cached: bool = False
 
 @app.get("/")
 async def root():
@@ -84,38 +105,109 @@ async def health_check():
             "document_service": "active",
             "qa_service": "active",
             "chat_service": "active"
-        }
+        },
+        "embedding_cache": registry.vector_store.embedding_cache.stats(),
+        "qa_cache": registry.qa_cache.stats(),
+        "chat_history_cache": chat_service.history_cache.stats()
     }
 
 @app.post("/upload", response_model=DocumentUploadResponse)
 async def upload_document(file: UploadFile = File(...)):
-    """Upload and process a document"""
+    """Upload a document and queue it for processing"""
     try:
         # Validate file type
         if not file_processor.is_supported_file(file.filename):
             raise HTTPException(status_code=400, detail="Unsupported file type")
         
-        # Process and store document
-        document_id = await document_service.upload_document(file)
+        # Store document and hand it to the ingestion workers
+        upload = await document_service.upload_document(file)
         
         return DocumentUploadResponse(
-            document_id=document_id,
+            document_id=upload["document_id"],
             filename=file.filename,
             status="success",
-            message="Document uploaded and processed successfully"
+            processed=upload["processed"],
+            message="Document uploaded and queued for processing" if upload["processed"] == "pending"
+            else "Identical document already processed, its content was reused"
         )
+    except HTTPException:
+        raise
+    except IngestionQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    except DocumentTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing document: {str(e)}")
 
 @app.get("/documents")
-async def list_documents():
-    """List all uploaded documents"""
+async def list_documents(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    sort: str = "upload_date",
+    order: str = "desc",
+    status: Optional[str] = None,
+    file_type: Optional[str] = None,
+    uploaded_after: Optional[datetime] = None,
+    uploaded_before: Optional[datetime] = None
+):
+    """List uploaded documents, one page at a time (pass next_cursor back as cursor)"""
     try:
-        documents = await document_service.list_documents()
-        return {"documents": documents}
+        return await document_service.list_documents(
+            limit=limit, cursor=cursor, sort=sort, order=order,
+            status=status, file_type=file_type,
+            uploaded_after=uploaded_after, uploaded_before=uploaded_before
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error listing documents: {str(e)}")
 
+@app.get("/documents/count")
+async def count_documents(
+    status: Optional[str] = None,
+    file_type: Optional[str] = None,
+    uploaded_after: Optional[datetime] = None,
+    uploaded_before: Optional[datetime] = None
+):
+    """Count documents matching the listing filters"""
+    try:
+        count = await document_service.count_documents(
+            status=status, file_type=file_type,
+            uploaded_after=uploaded_after, uploaded_before=uploaded_before
+        )
+        return {"count": count}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error counting documents: {str(e)}")
+
+@app.get("/search")
+async def search_documents(
+    q: str,
+    mode: Optional[str] = Query(None, pattern="^(dense|keyword|hybrid)$"),
+    limit: int = Query(5, ge=1, le=50),
+    document_id: Optional[str] = None
+):
+    """Search document chunks by meaning, by exact keywords, or both"""
+    try:
+        results = await document_service.search_documents(
+            q, limit=limit, document_id=document_id, mode=mode
+        )
+        return {
+            "results": [
+                {
+                    "document_id": result.document_id,
+                    "filename": result.filename,
+                    "chunk_index": result.chunk_index,
+                    "content": result.content,
+                    "similarity": result.similarity,
+                    "score": result.score,
+                    "page": result.page
+                }
+                for result in results
+            ]
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error searching documents: {str(e)}")
+
 @app.post("/qa", response_model=QAResponse)
 async def ask_question(
     question: str = Form(...),
@@ -133,11 +225,40 @@ async def ask_question(
         return QAResponse(
             answer=result["answer"],
             sources=result["sources"],
-            confidence=result["confidence"]
+            confidence=result["confidence"],
+            cached=result["cached"]
         )
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except DocumentBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing question: {str(e)}")
 
+def _sse_response(events: AsyncIterator[Dict]) -> StreamingResponse:
+    """Stream service events to the client as Server-Sent Events"""
+    async def encode():
+        try:
+            async for event in events:
+                event_type = event.pop("type")
+                yield f"event: {event_type}\ndata: {json.dumps(event)}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+    
+    return StreamingResponse(
+        encode(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/qa/stream")
+async def ask_question_stream(
+    question: str = Form(...),
+    document_id: Optional[str] = Form(None)
+):
+    """Ask a question about uploaded documents, streaming the answer as it is generated"""
+    return _sse_response(qa_service.stream_question(question, document_id))
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat(chat_message: ChatMessage):
     """General chat functionality"""
@@ -153,6 +274,44 @@ async def chat(chat_message: ChatMessage):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing chat: {str(e)}")
 
+@app.post("/chat/stream")
+async def chat_stream(chat_message: ChatMessage):
+    """General chat, streaming the response as it is generated"""
+    return _sse_response(
+        chat_service.stream_message(chat_message.message, chat_message.session_id)
+    )
+
+@app.put("/documents/{document_id}", response_model=DocumentUploadResponse)
+async def update_document(document_id: str, file: UploadFile = File(...)):
+    """Replace a document's file, re-embedding only chunks whose text changed"""
+    try:
+        # Validate file type
+        if not file_processor.is_supported_file(file.filename):
+            raise HTTPException(status_code=400, detail="Unsupported file type")
+        
+        upload = await document_service.update_document(document_id, file)
+        
+        return DocumentUploadResponse(
+            document_id=upload["document_id"],
+            filename=file.filename,
+            status="success",
+            processed=upload["processed"],
+            message="Document updated and queued for re-indexing" if upload["processed"] == "pending"
+            else "Document content is unchanged"
+        )
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except DocumentBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except IngestionQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    except DocumentTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error updating document: {str(e)}")
+
 @app.delete("/documents/{document_id}")
 async def delete_document(document_id: str):
     """Delete a specific document"""
@@ -162,14 +321,55 @@ async def delete_document(document_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting document: {str(e)}")
 
+@app.get("/documents/{document_id}/status", response_model=DocumentStatusResponse)
+async def get_document_status(document_id: str):
+    """Get the processing status and embedding progress of a document"""
+    try:
+        status = await document_service.get_ingestion_status(document_id)
+        return DocumentStatusResponse(**status)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving document status: {str(e)}")
+
 @app.get("/documents/{document_id}/content")
-async def get_document_content(document_id: str):
-    """Get the content of a specific document"""
+async def get_document_content(
+    document_id: str,
+    offset: int = Query(0, ge=0),
+    length: Optional[int] = Query(None, ge=0)
+):
+    """Get the extracted text of a document, or a character range of it"""
+    try:
+        return await document_service.get_document_content(document_id, offset, length)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving document content: {str(e)}")
+
+@app.get("/documents/{document_id}/content/stream")
+async def stream_document_content(
+    document_id: str,
+    offset: int = Query(0, ge=0),
+    length: Optional[int] = Query(None, ge=0)
+):
+    """Stream the extracted text of a document, or a character range of it, as plain text"""
+    parts = document_service.iter_document_content(document_id, offset, length)
     try:
-        content = await document_service.get_document_content(document_id)
-        return {"content": content}
+        # Resolve the document before the response starts so a miss can still be a 404
+        first = await parts.__anext__()
+    except StopAsyncIteration:
+        first = ""
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving document content: {str(e)}")
+    
+    async def body() -> AsyncIterator[str]:
+        yield first
+        async for part in parts:
+            yield part
+    
+    return StreamingResponse(body(), media_type="text/plain; charset=utf-8")
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
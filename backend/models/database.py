@@ -1,14 +1,49 @@
-from sqlalchemy import create_engine, Column, String, DateTime, Text, Integer, Float
+from sqlalchemy import Column, String, DateTime, Text, Integer, Float, LargeBinary, Index, event, inspect, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import deferred
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
 import os
 from datetime import datetime
 
 # Database configuration
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./document_qa.db")
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def _async_url(url: str) -> str:
+    """Map a plain database URL onto its async driver"""
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if url.startswith("postgresql:"):
+        return url.replace("postgresql:", "postgresql+asyncpg:", 1)
+    if url.startswith("postgres:"):
+        return url.replace("postgres:", "postgresql+asyncpg:", 1)
+    return url
+
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+engine = create_async_engine(
+    _async_url(DATABASE_URL),
+    pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+    pool_timeout=int(os.getenv("DB_POOL_TIMEOUT", "30")),
+    pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    pool_pre_ping=not IS_SQLITE
+)
+SessionLocal = async_sessionmaker(engine, expire_on_commit=False, autoflush=False)
+
+@event.listens_for(engine.sync_engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune every new SQLite connection: WAL lets readers run alongside the writer"""
+    if not IS_SQLITE:
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')}")
+    cursor.execute(f"PRAGMA cache_size=-{int(os.getenv('SQLITE_CACHE_KB', '65536'))}")
+    cursor.execute(f"PRAGMA busy_timeout={int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
 
 Base = declarative_base()
 
@@ -18,22 +53,40 @@ class Document(Base):
     id = Column(String, primary_key=True, index=True)
     filename = Column(String, index=True)
     file_type = Column(String)
-    file_size = Column(Integer)
-    upload_date = Column(DateTime, default=datetime.utcnow)
-    processed = Column(String, default="pending")  # pending, processing, completed, failed
-    content = Column(Text)
+    file_size = Column(Integer)  # bytes
+    content_hash = Column(String, index=True)  # SHA-256 of the uploaded file
+    storage_id = Column(String, index=True)  # owner of the shared text, chunks and file (own id unless deduplicated)
+    upload_date = Column(DateTime, default=datetime.utcnow, index=True)
+    processed = Column(String, default="pending", index=True)  # pending, processing, completed, failed
+    content = deferred(Column(Text))  # legacy inline text, moved to document_text_segments on first read
+    content_length = Column(Integer)  # characters of extracted text in document_text_segments
     document_metadata = Column(Text)  # JSON string for additional metadata
 
+class DocumentTextSegment(Base):
+    __tablename__ = "document_text_segments"
+    
+    document_id = Column(String, primary_key=True)
+    segment_index = Column(Integer, primary_key=True)
+    start_offset = Column(Integer)  # [start, end) character range of the segment
+    end_offset = Column(Integer)
+    data = Column(LargeBinary)  # zlib-compressed UTF-8 text
+
 class ChatSession(Base):
     __tablename__ = "chat_sessions"
     
     id = Column(String, primary_key=True, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
-    last_activity = Column(DateTime, default=datetime.utcnow)
+    last_activity = Column(DateTime, default=datetime.utcnow, index=True)  # expiry scans
     message_count = Column(Integer, default=0)
+    summary = Column(Text)  # rolling summary of messages older than the history window
+    summary_through = Column(DateTime)  # timestamp of the last message folded into the summary
 
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
+    __table_args__ = (
+        # Recent-history reads filter by session and order by time
+        Index("ix_chat_messages_session_timestamp", "session_id", "timestamp"),
+    )
     
     id = Column(String, primary_key=True, index=True)
     session_id = Column(String, index=True)
@@ -49,19 +102,43 @@ class QARecord(Base):
     id = Column(String, primary_key=True, index=True)
     question = Column(Text)
     answer = Column(Text)
-    document_id = Column(String, index=True)
+    document_id = Column(String, index=True)  # NULL for questions about all documents
     confidence = Column(Float)
     sources = Column(Text)  # JSON string of source documents
     timestamp = Column(DateTime, default=datetime.utcnow)
+    question_hash = Column(String, index=True)  # hash of the normalized question
+    question_embedding = Column(LargeBinary)  # float32 vector for near-duplicate lookup
+    hit_count = Column(Integer, default=0)
 
 async def init_db():
     """Initialize the database"""
-    Base.metadata.create_all(bind=engine)
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+        await connection.run_sync(_add_missing_columns)
+
+def _add_missing_columns(connection):
+    """Add columns introduced after a table was first created (additive changes only)"""
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=connection.dialect)
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+    
+    # Indexes on added columns are not created by create_all for existing tables
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=connection, checkfirst=True)
 
-def get_db():
+async def get_db() -> AsyncIterator[AsyncSession]:
     """Get database session"""
-    db = SessionLocal()
-    try:
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+@asynccontextmanager
+async def session_scope() -> AsyncIterator[AsyncSession]:
+    """Unit of work: one session and one transaction, committed on success"""
+    async with SessionLocal() as db:
+        async with db.begin():
+            yield db
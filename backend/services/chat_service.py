@@ -1,18 +1,34 @@
 import os
+import time
 import uuid
-import openai
-from typing import Dict, List, Optional
-from sqlalchemy.orm import Session
-\
+import asyncio
+from typing import Dict, List, Optional, AsyncIterator, Tuple
+from sqlalchemy import select, insert, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from models.database import ChatSession, ChatMessage, get_db
+from models.database import ChatSession, ChatMessage, SessionLocal, session_scope
+from services.registry import ServiceRegistry, get_registry
+from utils.session_cache import SessionHistoryCache
+from utils.tokens import count_tokens
 from datetime import datetime, timedelta
 import json
 
 class ChatService:
-    def __init__(self):
-        self.openai_client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        self.max_session_age = timedelta(hours=24)
+    def __init__(self, registry: Optional[ServiceRegistry] = None):
+        self.registry = registry or get_registry()
+        self.openai_client = self.registry.openai_client
+        self.max_session_age = timedelta(hours=float(os.getenv("SESSION_MAX_AGE_HOURS", "24")))
+        self.cleanup_interval = float(os.getenv("SESSION_CLEANUP_INTERVAL", "3600"))
+        self.cleanup_batch_size = int(os.getenv("SESSION_CLEANUP_BATCH", "500"))
+        self.cleanup_pause = float(os.getenv("SESSION_CLEANUP_PAUSE", "0.05"))
+        self._cleanup_task: Optional[asyncio.Task] = None
+        self.history_cache = SessionHistoryCache()
+        self.history_tokens = int(os.getenv("CHAT_HISTORY_TOKENS", "2000"))
+        self.summary_min_messages = int(os.getenv("CHAT_SUMMARY_MIN_MESSAGES", "4"))
+        self.summary_tokens = int(os.getenv("CHAT_SUMMARY_TOKENS", "300"))
+        self.summary_batch = int(os.getenv("CHAT_SUMMARY_BATCH", "40"))
+        self._summarizing = set()
+        self._background_tasks = set()
     
     async def initialize(self):
         """Initialize the chat service"""
@@ -21,21 +37,19 @@ class ChatService:
     async def process_message(self, message: str, session_id: Optional[str] = None) -> Dict:
         """Process a chat message and return response"""
         try:
-            # Get or create session
-            if not session_id:
-                session_id = await self._create_session()
-            else:
-                await self._update_session_activity(session_id)
+            is_new_session = not session_id
+            session_id = session_id or str(uuid.uuid4())
             
             # Get conversation history
-            history = await self._get_conversation_history(session_id)
+            history = None if is_new_session else await self._get_conversation_history(session_id)
             
             # Generate response using OpenAI
-            response = await self._generate_response(message, history)
+            response = await self._generate_response(message, history["messages"] if history else [])
             
-            # Save message and response to database
-            await self._save_message(session_id, message, response, "user")
-            await self._save_message(session_id, response, "", "assistant")
+            # Save session, message and response in one transaction
+            await self._save_turn(session_id, message, response, is_new_session)
+            if history:
+                self._schedule_summary(session_id, history)
             
             return {
                 "message": response,
@@ -45,78 +59,226 @@ class ChatService:
         except Exception as e:
             raise Exception(f"Error processing chat message: {str(e)}")
     
-    async def _create_session(self) -> str:
+    async def _save_turn(self, session_id: str, message: str, response: str, is_new_session: bool = False):
+        """Persist a chat turn in one transaction: session upsert plus one bulk message insert"""
+        async with self.history_cache.lock(session_id):
+            # Stamped under the lock so timestamp order matches the cached order
+            now = datetime.utcnow()
+            rows = [
+                self._message_row(session_id, message, response, "user", now),
+                # One microsecond later keeps the pair ordered by timestamp
+                self._message_row(session_id, response, "", "assistant", now + timedelta(microseconds=1))
+            ]
+            
+            async with session_scope() as db:
+                if is_new_session or not await self._update_session_activity(db, session_id, len(rows), now):
+                    await self._create_session(db, session_id, len(rows), now)
+                
+                await db.execute(insert(ChatMessage), rows)
+            
+            # Write through once committed; a new session's history is exactly this turn
+            self.history_cache.append(
+                session_id,
+                [self._history_entry(row["message_type"], row["message"], row["timestamp"]) for row in rows],
+                create=is_new_session
+            )
+    
+    async def _create_session(self, db: AsyncSession, session_id: str, message_count: int, now: datetime):
         """Create a new chat session"""
-        session_id = str(uuid.uuid4())
-        db = next(get_db())
-        
-        session = ChatSession(
-            id=session_id,
-            created_at=datetime.utcnow(),
-            last_activity=datetime.utcnow()
+        await db.execute(
+            insert(ChatSession).values(
+                id=session_id,
+                created_at=now,
+                last_activity=now,
+                message_count=message_count
+            )
         )
-        
-        db.add(session)
-        db.commit()
-        db.close()
-        
-        return session_id
     
-    async def _update_session_activity(self, session_id: str):
-        """Update session last activity"""
-        db = next(get_db())
-        session = db.query(ChatSession).filter(ChatSession.id == session_id).first()
+    async def _update_session_activity(self, db: AsyncSession, session_id: str,
+                                       message_count: int, now: datetime) -> bool:
+        """Bump session activity and message count in SQL; False if the session does not exist"""
+        result = await db.execute(
+            update(ChatSession).where(ChatSession.id == session_id).values(
+                last_activity=now,
+                message_count=ChatSession.message_count + message_count
+            )
+        )
+        return result.rowcount > 0
+    
+    async def _get_recent_messages(self, session_id: str) -> Tuple[List[Dict], Optional[Dict]]:
+        """Recent messages (oldest first) and rolling summary, from the session cache when it is hot"""
+        messages = self.history_cache.get(session_id)
+        if messages is not None:
+            return messages, self.history_cache.get_summary(session_id)
         
-        if session:
-            session.last_activity = datetime.utcnow()
-            session.message_count += 1
-            db.commit()
+        # Cold load under the session lock so a concurrent write-through cannot be lost
+        async with self.history_cache.lock(session_id):
+            async with SessionLocal() as db:
+                session = await db.get(ChatSession, session_id)
+                result = await db.execute(
+                    select(
+                        ChatMessage.message_type, ChatMessage.message, ChatMessage.timestamp
+                    ).filter(
+                        ChatMessage.session_id == session_id
+                    ).order_by(ChatMessage.timestamp.desc()).limit(self.history_cache.max_messages)
+                )
+                rows = result.all()
+            
+            messages = [
+                self._history_entry(row.message_type, row.message, row.timestamp)
+                for row in reversed(rows)
+            ]
+            summary = None
+            if session and session.summary:
+                summary = {"text": session.summary, "through": session.summary_through}
+            self.history_cache.load(session_id, messages, summary)
         
-        db.close()
+        return messages, summary
     
-    async def _get_conversation_history(self, session_id: str, limit: int = 10) -> List[Dict]:
-        """Get conversation history for a session"""
-        db = next(get_db())
-        messages = db.query(ChatMessage).filter(
-            ChatMessage.session_id == session_id
-        ).order_by(ChatMessage.timestamp.desc()).limit(limit).all()
+    async def _get_conversation_history(self, session_id: str) -> Dict:
+        """Rolling summary plus as many recent messages as fit the history token budget"""
+        messages, summary = await self._get_recent_messages(session_id)
+        through = summary["through"] if summary else None
+        budget = self.history_tokens - (count_tokens(summary["text"]) if summary else 0)
         
-        db.close()
+        # Newest first until the budget runs out or the summary already covers the message
+        window = []
+        for entry in reversed(messages):
+            if (through and entry["timestamp"] <= through) or entry["tokens"] > budget:
+                break
+            budget -= entry["tokens"]
+            window.append(entry)
+        window.reverse()
+        
+        # Older messages that neither the window nor the summary covers get folded in later
+        skipped = messages[:len(messages) - len(window)]
+        unsummarized = [entry for entry in skipped if not through or entry["timestamp"] > through]
+        beyond_cache = (
+            len(messages) == self.history_cache.max_messages
+            and (not through or messages[0]["timestamp"] > through)
+        )
         
-        # Convert to OpenAI format and reverse order
         history = []
-        for msg in reversed(messages):
+        if summary:
             history.append({
-                "role": msg.message_type,
-                "content": msg.message if msg.message_type == "user" else msg.response
+                "role": "system",
+                "content": f"Summary of the earlier conversation: {summary['text']}"
             })
+        history.extend({"role": entry["role"], "content": entry["content"]} for entry in window)
         
-        return history
+        return {
+            "messages": history,
+            "needs_summary": len(unsummarized) >= self.summary_min_messages or (beyond_cache and bool(skipped)),
+            "summarize_before": window[0]["timestamp"] if window else None
+        }
     
-    async def _generate_response(self, message: str, history: List[Dict]) -> str:
-        """Generate response using OpenAI"""
+    def _history_entry(self, message_type: str, message: str, timestamp: datetime) -> Dict:
+        """Convert a stored message into a history entry with its token count"""
+        return {
+            "role": message_type,
+            "content": message,
+            "timestamp": timestamp,
+            "tokens": count_tokens(message or "")
+        }
+    
+    def _schedule_summary(self, session_id: str, history: Dict):
+        """Refresh the rolling summary in the background once enough messages fell out of the window"""
+        if not history["needs_summary"] or session_id in self._summarizing:
+            return
+        
+        self._summarizing.add(session_id)
+        task = asyncio.create_task(self._refresh_summary(session_id, history["summarize_before"]))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        task.add_done_callback(lambda _: self._summarizing.discard(session_id))
+    
+    async def _refresh_summary(self, session_id: str, summarize_before: Optional[datetime]):
+        """Fold messages older than the history window into the stored summary"""
         try:
-            # Prepare messages for OpenAI
-            messages = [
-                {
-                    "role": "system",
-                    "content": "You are a helpful AI assistant. You can help with general questions, provide information, and assist with various tasks. Be friendly, informative, and concise in your responses."
-                }
-            ]
+            async with SessionLocal() as db:
+                session = await db.get(ChatSession, session_id)
+                if not session:
+                    return
+                previous_summary, previous_through = session.summary, session.summary_through
+                
+                query = select(
+                    ChatMessage.message_type, ChatMessage.message, ChatMessage.timestamp
+                ).filter(ChatMessage.session_id == session_id)
+                if previous_through:
+                    query = query.filter(ChatMessage.timestamp > previous_through)
+                if summarize_before:
+                    query = query.filter(ChatMessage.timestamp < summarize_before)
+                # Oldest first and bounded, so a long backlog is folded over several turns
+                rows = (await db.execute(
+                    query.order_by(ChatMessage.timestamp.asc()).limit(self.summary_batch)
+                )).all()
             
-            # Add conversation history
-            messages.extend(history)
+            if not rows:
+                return
             
-            # Add current message
-            messages.append({
-                "role": "user",
-                "content": message
-            })
+            transcript = "\n".join(
+                f"{'User' if row.message_type == 'user' else 'Assistant'}: {row.message}" for row in rows
+            )
+            response = await self.openai_client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=[
+                    {
+                        "role": "system",
+                        "content": "Summarize this conversation so it can be continued later. Keep names, facts, decisions and open questions. Be concise."
+                    },
+                    {
+                        "role": "user",
+                        "content": f"Summary so far:\n{previous_summary or '(none)'}\n\nNew messages:\n{transcript}"
+                    }
+                ],
+                max_tokens=self.summary_tokens,
+                temperature=0.3
+            )
+            summary = {"text": response.choices[0].message.content, "through": rows[-1].timestamp}
             
+            # Only advance a summary nobody else has advanced in the meantime
+            async with session_scope() as db:
+                result = await db.execute(
+                    update(ChatSession).where(
+                        ChatSession.id == session_id,
+                        ChatSession.summary_through.is_(None) if previous_through is None
+                        else ChatSession.summary_through == previous_through
+                    ).values(summary=summary["text"], summary_through=summary["through"])
+                )
+            if result.rowcount:
+                self.history_cache.set_summary(session_id, summary)
+        
+        except Exception:
+            # The window alone still works and the next turn retries
+            return
+    
+    def _build_messages(self, message: str, history: List[Dict]) -> List[Dict]:
+        """Prepare messages for OpenAI"""
+        messages = [
+            {
+                "role": "system",
+                "content": "You are a helpful AI assistant. You can help with general questions, provide information, and assist with various tasks. Be friendly, informative, and concise in your responses."
+            }
+        ]
+        
+        # Add conversation history
+        messages.extend(history)
+        
+        # Add current message
+        messages.append({
+            "role": "user",
+            "content": message
+        })
+        
+        return messages
+    
+    async def _generate_response(self, message: str, history: List[Dict]) -> str:
+        """Generate response using OpenAI"""
+        try:
             # Generate response
-            response = self.openai_client.chat.completions.create(
+            response = await self.openai_client.chat.completions.create(
                 model="gpt-3.5-turbo",
-                messages=messages,
+                messages=self._build_messages(message, history),
                 max_tokens=500,
                 temperature=0.7
             )
@@ -126,31 +288,72 @@ class ChatService:
         except Exception as e:
             return "I'm sorry, I'm having trouble processing your request right now. Please try again later."
     
-    async def _save_message(self, session_id: str, message: str, response: str, message_type: str):
-        """Save message to database"""
-        db = next(get_db())
-        
-        chat_message = ChatMessage(
-            id=str(uuid.uuid4()),
-            session_id=session_id,
-            message=message,
-            response=response,
-            message_type=message_type,
-            timestamp=datetime.utcnow()
-        )
+    async def stream_message(self, message: str, session_id: Optional[str] = None) -> AsyncIterator[Dict]:
+        """Process a chat message, yielding response tokens as they arrive"""
+        started = time.perf_counter()
+        
+        # New sessions get their id now and their row with the first turn
+        is_new_session = not session_id
+        session_id = session_id or str(uuid.uuid4())
+        yield {"type": "session", "session_id": session_id}
+        
+        # Get conversation history
+        history = None if is_new_session else await self._get_conversation_history(session_id)
         
-        db.add(chat_message)
-        db.commit()
-        db.close()
+        ttft_ms = None
+        parts = []
+        try:
+            stream = await self.openai_client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=self._build_messages(message, history["messages"] if history else []),
+                max_tokens=500,
+                temperature=0.7,
+                stream=True
+            )
+            async for chunk in stream:
+                token = chunk.choices[0].delta.content if chunk.choices else None
+                if not token:
+                    continue
+                if ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - started) * 1000
+                parts.append(token)
+                yield {"type": "token", "content": token}
+        except Exception as e:
+            if not parts:
+                fallback = "I'm sorry, I'm having trouble processing your request right now. Please try again later."
+                parts.append(fallback)
+                yield {"type": "token", "content": fallback}
+        
+        # Save the full exchange once the stream is complete
+        response = "".join(parts)
+        await self._save_turn(session_id, message, response, is_new_session)
+        if history:
+            self._schedule_summary(session_id, history)
+        
+        yield {"type": "done", "session_id": session_id, "message": response, "ttft_ms": ttft_ms}
+    
+    def _message_row(self, session_id: str, message: str, response: str,
+                     message_type: str, timestamp: datetime) -> Dict:
+        """Build a chat_messages row for a bulk insert"""
+        return {
+            "id": str(uuid.uuid4()),
+            "session_id": session_id,
+            "message": message,
+            "response": response,
+            "message_type": message_type,
+            "timestamp": timestamp,
+            "confidence": 0.0
+        }
     
     async def get_session_history(self, session_id: str) -> List[Dict]:
         """Get full conversation history for a session"""
-        db = next(get_db())
-        messages = db.query(ChatMessage).filter(
-            ChatMessage.session_id == session_id
-        ).order_by(ChatMessage.timestamp.asc()).all()
-        
-        db.close()
+        async with SessionLocal() as db:
+            result = await db.execute(
+                select(ChatMessage).filter(
+                    ChatMessage.session_id == session_id
+                ).order_by(ChatMessage.timestamp.asc())
+            )
+            messages = result.scalars().all()
         
         return [
             {
@@ -163,24 +366,84 @@ class ChatService:
             for msg in messages
         ]
     
-    async def cleanup_old_sessions(self):
-        """Clean up old chat sessions"""
+    def start_cleanup(self):
+        """Start the periodic background cleanup of expired sessions"""
+        if self._cleanup_task is None and self.cleanup_interval > 0:
+            self._cleanup_task = asyncio.create_task(self._cleanup_loop())
+    
+    async def shutdown(self):
+        """Stop the cleanup loop and pending summary refreshes"""
+        tasks = list(self._background_tasks)
+        if self._cleanup_task is not None:
+            tasks.append(self._cleanup_task)
+            self._cleanup_task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    
+    async def _cleanup_loop(self):
+        """Run cleanup_old_sessions every SESSION_CLEANUP_INTERVAL seconds"""
+        while True:
+            await asyncio.sleep(self.cleanup_interval)
+            try:
+                await self.cleanup_old_sessions()
+            except Exception:
+                # A failed pass is retried on the next interval
+                continue
+    
+    async def cleanup_old_sessions(self) -> int:
+        """Clean up old chat sessions in bounded batches, returning the number of sessions removed"""
         cutoff_time = datetime.utcnow() - self.max_session_age
-        db = next(get_db())
-        
-        # Delete old sessions and their messages
-        old_sessions = db.query(ChatSession).filter(
-            ChatSession.last_activity < cutoff_time
-        ).all()
+        removed = 0
         
-        for session in old_sessions:
-            # Delete messages
-            db.query(ChatMessage).filter(
-                ChatMessage.session_id == session.id
-            ).delete()
+        while True:
+            # Expired sessions, oldest first, found through the last_activity index
+            async with SessionLocal() as db:
+                result = await db.execute(
+                    select(ChatSession.id).filter(
+                        ChatSession.last_activity < cutoff_time
+                    ).order_by(ChatSession.last_activity).limit(self.cleanup_batch_size)
+                )
+                session_ids = result.scalars().all()
+            
+            if not session_ids:
+                break
+            
+            # Delete messages in bounded set-based batches so no transaction grows with session size;
+            # each batch re-checks the cutoff so a session active again meanwhile keeps its history
+            still_expired = select(ChatSession.id).filter(
+                ChatSession.id.in_(session_ids),
+                ChatSession.last_activity < cutoff_time
+            )
+            while True:
+                async with session_scope() as db:
+                    result = await db.execute(
+                        delete(ChatMessage).filter(ChatMessage.id.in_(
+                            select(ChatMessage.id).filter(
+                                ChatMessage.session_id.in_(still_expired)
+                            ).limit(self.cleanup_batch_size)
+                        ))
+                    )
+                if result.rowcount < self.cleanup_batch_size:
+                    break
+                await asyncio.sleep(0)
+            
+            # Delete sessions, skipping any that became active again meanwhile
+            async with session_scope() as db:
+                await db.execute(
+                    delete(ChatSession).filter(
+                        ChatSession.id.in_(session_ids),
+                        ChatSession.last_activity < cutoff_time
+                    )
+                )
+            
+            for session_id in session_ids:
+                self.history_cache.evict(session_id)
+            removed += len(session_ids)
             
-            # Delete session
-            db.delete(session)
+            if len(session_ids) < self.cleanup_batch_size:
+                break
+            # Let request handlers in between batches
+            await asyncio.sleep(self.cleanup_pause)
         
-        db.commit()
-        db.close()
+        return removed
@@ -1,124 +1,635 @@
 import os
 import uuid
 import asyncio
-from typing import List, Dict, Optional
-from sqlalchemy.orm import Session
-from models.database import Document, get_db
+import glob
+import hashlib
+import aiofiles
+from typing import List, Dict, Optional, AsyncIterator, Tuple, Union
+from sqlalchemy import select, insert, update, delete, func, or_, and_, literal, String, DateTime
+from models.database import Document, SessionLocal, session_scope
 from utils.file_processor import FileProcessor
-from utils.vector_store_light import VectorStoreLight
+from utils.vector_store_light import SearchResult
+from services.registry import ServiceRegistry, get_registry
+from services.ingestion_service import IngestionService, IngestionQueueFull, IngestionCancelled
+from utils.executors import run_in_thread
 import json
+import base64
 from datetime import datetime
 
+class DocumentTooLarge(Exception):
+    """Raised when an upload exceeds the configured size limit"""
+    pass
+
+class DocumentBusy(Exception):
+    """Raised when a document cannot be changed while it is being processed"""
+    pass
+
 class DocumentService:
-    def __init__(self):
+    # Sortable listing fields
+    SORT_COLUMNS = {
+        "upload_date": Document.upload_date,
+        "filename": Document.filename,
+        "file_size": Document.file_size
+    }
+    MAX_PAGE_SIZE = 1000
+    
+    def __init__(self, registry: Optional[ServiceRegistry] = None):
+        self.registry = registry or get_registry()
         self.file_processor = FileProcessor()
-        self.vector_store = VectorStoreLight()
+        self.vector_store = self.registry.vector_store
+        self.text_store = self.registry.text_store
+        self.ingestion = IngestionService(self._ingest_document)
+        self._resume_task: Optional[asyncio.Task] = None
         self.upload_dir = os.getenv("UPLOAD_DIRECTORY", "./uploads")
+        self.max_upload_size = int(float(os.getenv("MAX_UPLOAD_SIZE_MB", "50")) * 1024 * 1024)
+        self.upload_chunk_size = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
         os.makedirs(self.upload_dir, exist_ok=True)
     
     async def initialize(self):
         """Initialize the document service"""
-        await self.vector_store.initialize()
+        await self.registry.initialize()
+        await self._backfill_storage_ids()
+        await self.ingestion.initialize()
+        await self._resume_pending_documents()
+    
+    async def shutdown(self):
+        """Stop background ingestion workers"""
+        if self._resume_task:
+            self._resume_task.cancel()
+            await asyncio.gather(self._resume_task, return_exceptions=True)
+            self._resume_task = None
+        await self.ingestion.shutdown()
     
-    async def upload_document(self, file) -> str:
-        """Upload and process a document"""
+    async def _backfill_storage_ids(self):
+        """Documents created before deduplication own their storage"""
+        async with session_scope() as db:
+            await db.execute(
+                update(Document).filter(Document.storage_id.is_(None)).values(storage_id=Document.id)
+            )
+    
+    async def upload_document(self, file) -> Dict:
+        """Save an uploaded document and queue it for background processing (or reuse an identical one)"""
+        # Reject early instead of writing a file we cannot process
+        if self.ingestion.is_full():
+            raise IngestionQueueFull("Ingestion queue is full, try again later")
+        if file.size is not None and file.size > self.max_upload_size:
+            raise DocumentTooLarge(self._too_large_message())
+        
         document_id = str(uuid.uuid4())
         
-        try:
-            # Save file to disk
-            file_path = os.path.join(self.upload_dir, f"{document_id}_{file.filename}")
-            with open(file_path, "wb") as buffer:
-                content = await file.read()
-                buffer.write(content)
-            
-            # Process document content
-            content = await self.file_processor.process_file(file_path)
-            
-            # Store in database
-            db = next(get_db())
+        # Stream file to disk
+        file_path = os.path.join(self.upload_dir, f"{document_id}_{file.filename}")
+        file_size, content_hash = await self._save_upload(file, file_path)
+        
+        # Identical content already processed: share its text and vectors instead
+        if await self._insert_processed_copy(document_id, file, file_size, content_hash):
+            await run_in_thread(os.remove, file_path)
+            await self.registry.qa_cache.invalidate_document(document_id)
+            return {"document_id": document_id, "processed": "completed"}
+        
+        # Store in database as pending, the ingestion workers take it from here
+        async with session_scope() as db:
             document = Document(
                 id=document_id,
                 filename=file.filename,
                 file_type=file.content_type,
-                file_size=len(content),
-                processed="processing",
-                content=content
+                file_size=file_size,
+                content_hash=content_hash,
+                storage_id=document_id,
+                processed="pending"
             )
             db.add(document)
-            db.commit()
+        
+        try:
+            self.ingestion.submit(document_id, file_path=file_path, filename=file.filename, storage_id=document_id)
+        except IngestionQueueFull:
+            await self._set_status(document_id, "failed")
+            raise
+        
+        return {"document_id": document_id, "processed": "pending"}
+    
+    async def update_document(self, document_id: str, file) -> Dict:
+        """Replace a document's file and queue an incremental re-index of its content"""
+        async with SessionLocal() as db:
+            result = await db.execute(
+                select(Document.storage_id, Document.processed, Document.content_hash).filter(
+                    Document.id == document_id
+                )
+            )
+            document = result.first()
+        
+        if not document:
+            raise ValueError("Document not found")
+        if self.ingestion.is_full():
+            raise IngestionQueueFull("Ingestion queue is full, try again later")
+        if file.size is not None and file.size > self.max_upload_size:
+            raise DocumentTooLarge(self._too_large_message())
+        
+        # Claim the document atomically; a concurrent update or ingestion already holds it otherwise
+        async with session_scope() as db:
+            result = await db.execute(
+                update(Document).filter(
+                    Document.id == document_id,
+                    Document.processed.notin_(["pending", "processing"])
+                ).values(processed="pending")
+            )
+        if result.rowcount == 0:
+            raise DocumentBusy("Document is still being processed, try again later")
+        
+        try:
+            storage_id = document.storage_id or document_id
+            async with SessionLocal() as db:
+                result = await db.execute(
+                    select(func.count(Document.id)).filter(Document.storage_id == storage_id)
+                )
+                shared = result.scalar_one() > 1
             
-            # Create embeddings and store in vector database
-            await self.vector_store.add_document(document_id, content, file.filename)
+            # Documents sharing storage keep it; this one gets a copy to change
+            new_storage_id = str(uuid.uuid4()) if shared else storage_id
+            file_path = os.path.join(self.upload_dir, f"{new_storage_id}_{file.filename}")
             
-            # Update document status
-            document.processed = "completed"
-            db.commit()
-            db.close()
+            # Keep the old file until the new one is completely on disk
+            partial_path = os.path.join(self.upload_dir, f"{new_storage_id}.update")
+            file_size, content_hash = await self._save_upload(file, partial_path)
+        except BaseException:
+            await self._set_status(document_id, document.processed)
+            raise
+        
+        if content_hash == document.content_hash and document.processed == "completed":
+            await run_in_thread(os.remove, partial_path)
+            await self._set_status(document_id, "completed")
+            return {"document_id": document_id, "processed": "completed"}
+        
+        if not shared:
+            old_paths = await run_in_thread(
+                glob.glob, os.path.join(glob.escape(self.upload_dir), f"{storage_id}_*")
+            )
+            for old_path in old_paths:
+                await run_in_thread(os.remove, old_path)
+        await run_in_thread(os.replace, partial_path, file_path)
+        
+        async with session_scope() as db:
+            await db.execute(
+                update(Document).filter(Document.id == document_id).values(
+                    filename=file.filename,
+                    file_type=file.content_type,
+                    file_size=file_size,
+                    content_hash=content_hash,
+                    storage_id=new_storage_id
+                )
+            )
+        
+        try:
+            self.ingestion.submit(
+                document_id, file_path=file_path, filename=file.filename, storage_id=new_storage_id,
+                source_storage_id=storage_id if shared else None
+            )
+        except IngestionQueueFull:
+            await self._set_status(document_id, "failed")
+            raise
+        
+        return {"document_id": document_id, "processed": "pending"}
+    
+    async def _insert_processed_copy(self, document_id: str, file, file_size: int, content_hash: str) -> bool:
+        """Add the document sharing the storage of a completed copy with the same content, if any
+        
+        Lookup and insert are one INSERT ... SELECT, so a concurrent delete of the last
+        reference either sees this row and keeps the storage, or removes the copy first.
+        """
+        source = select(
+            literal(document_id), literal(file.filename, String), literal(file.content_type, String),
+            literal(file_size), literal(content_hash), Document.storage_id,
+            literal(datetime.utcnow(), DateTime), literal("completed"),
+            Document.content_length, Document.document_metadata
+        ).filter(
+            Document.content_hash == content_hash,
+            Document.processed == "completed",
+            Document.storage_id.isnot(None)
+        ).limit(1)
+        
+        async with session_scope() as db:
+            result = await db.execute(
+                insert(Document).from_select(
+                    ["id", "filename", "file_type", "file_size", "content_hash", "storage_id",
+                     "upload_date", "processed", "content_length", "document_metadata"],
+                    source
+                )
+            )
+        return result.rowcount > 0
+    
+    async def _save_upload(self, file, file_path: str) -> Tuple[int, str]:
+        """Copy an upload to disk in fixed-size chunks, returning its size and SHA-256"""
+        partial_path = f"{file_path}.part"
+        digest = hashlib.sha256()
+        size = 0
+        
+        try:
+            async with aiofiles.open(partial_path, "wb") as buffer:
+                while True:
+                    chunk = await file.read(self.upload_chunk_size)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_upload_size:
+                        raise DocumentTooLarge(self._too_large_message())
+                    digest.update(chunk)
+                    await buffer.write(chunk)
+            
+            # Only complete uploads ever appear under the final name
+            await run_in_thread(os.replace, partial_path, file_path)
+        except BaseException:
+            if os.path.exists(partial_path):
+                await run_in_thread(os.remove, partial_path)
+            raise
+        
+        return size, digest.hexdigest()
+    
+    def _too_large_message(self) -> str:
+        """Error message for an oversized upload"""
+        return f"File exceeds the maximum upload size of {self.max_upload_size // (1024 * 1024)} MB"
+    
+    async def _ingest_document(self, job: Dict):
+        """Extract, embed and store a queued document"""
+        document_id = job["document_id"]
+        file_path = job["params"]["file_path"]
+        filename = job["params"]["filename"]
+        storage_id = job["params"].get("storage_id", document_id)
+        # Copy-on-write updates reuse chunks from the storage they used to share
+        source_storage_id = job["params"].get("source_storage_id")
+        
+        def on_progress(embedded: int, total: int, reused: int):
+            job["chunks_embedded"] = embedded
+            job["chunks_total"] = total
+            job["chunks_reused"] = reused
+        
+        try:
+            await self._set_status(document_id, "processing")
+            
+            # Process document content
+            extracted = await self.file_processor.extract(file_path)
+            content = extracted.text
+            
+            # Text goes to the segment store, the row only records its length
+            await self.text_store.put(storage_id, content)
+            async with session_scope() as db:
+                document = await db.get(Document, document_id)
+                if document:
+                    document.content_length = len(content)
+                    document.document_metadata = (
+                        json.dumps({"page_offsets": extracted.page_offsets}) if extracted.page_offsets else None
+                    )
+                    upload_date = document.upload_date
+            if not document or job["cancelled"]:
+                await self._discard_orphaned_storage(storage_id)
+                raise IngestionCancelled("Document was deleted before processing")
+            
+            # Embed new or changed chunks and store them in the vector database
+            stats = await self.vector_store.update_document(
+                storage_id, content, filename,
+                upload_date=upload_date, page_offsets=extracted.page_offsets,
+                progress_callback=on_progress, source_id=source_storage_id
+            )
+            job["chunks_reused"] = stats["chunks_reused"]
             
-            return document_id
+            # The document may have been deleted while it was embedded
+            async with session_scope() as db:
+                document = await db.get(Document, document_id)
+                if document and not job["cancelled"]:
+                    document.processed = "completed"
+            if not document or job["cancelled"]:
+                await self._discard_orphaned_storage(storage_id)
+                raise IngestionCancelled("Document was deleted during processing")
             
-        except Exception as e:
-            # Update document status to failed
-            db = next(get_db())
-            document = db.query(Document).filter(Document.id == document_id).first()
+            await self.registry.qa_cache.invalidate_document(document_id)
+            
+        except Exception:
+            await self._set_status(document_id, "failed")
+            raise
+    
+    async def _discard_orphaned_storage(self, storage_id: str):
+        """Remove chunks, keyword postings and text written for storage no document references"""
+        async with SessionLocal() as db:
+            result = await db.execute(
+                select(func.count(Document.id)).filter(Document.storage_id == storage_id)
+            )
+            if result.scalar_one():
+                return
+        
+        await self.vector_store.delete_document(storage_id)
+        await self.text_store.delete(storage_id)
+    
+    async def _set_status(self, document_id: str, status: str):
+        """Update the processing status of a document"""
+        async with session_scope() as db:
+            document = await db.get(Document, document_id)
             if document:
-                document.processed = "failed"
-                db.commit()
-            db.close()
-            raise e
-    
-    async def list_documents(self) -> List[Dict]:
-        """List all uploaded documents"""
-        db = next(get_db())
-        documents = db.query(Document).all()
-        db.close()
-        
-        return [
-            {
-                "id": doc.id,
-                "filename": doc.filename,
-                "file_type": doc.file_type,
-                "file_size": doc.file_size,
-                "upload_date": doc.upload_date.isoformat(),
-                "processed": doc.processed
-            }
-            for doc in documents
-        ]
+                document.processed = status
     
-    async def get_document_content(self, document_id: str) -> str:
-        """Get the content of a specific document"""
-        db = next(get_db())
-        document = db.query(Document).filter(Document.id == document_id).first()
-        db.close()
+    async def _resume_pending_documents(self):
+        """Re-queue documents interrupted by a restart"""
+        async with SessionLocal() as db:
+            result = await db.execute(
+                select(Document.id, Document.filename, Document.storage_id).filter(
+                    Document.processed.in_(["pending", "processing"])
+                )
+            )
+            documents = result.all()
+        
+        # More interrupted documents than the queue holds are fed in as workers free up
+        if documents:
+            self._resume_task = asyncio.create_task(self._requeue_documents(documents))
+    
+    async def _requeue_documents(self, documents):
+        """Queue interrupted documents, waiting for room rather than failing them"""
+        for document_id, filename, storage_id in documents:
+            storage_id = storage_id or document_id
+            file_path = os.path.join(self.upload_dir, f"{storage_id}_{filename}")
+            if not await run_in_thread(os.path.exists, file_path):
+                await self._set_status(document_id, "failed")
+                continue
+            await self.ingestion.enqueue(
+                document_id, file_path=file_path, filename=filename, storage_id=storage_id
+            )
+    
+    async def get_ingestion_status(self, document_id: str) -> Dict:
+        """Get processing status and embedding progress of a document"""
+        job = self.ingestion.get_job(document_id)
+        if job:
+            return {
+                "document_id": document_id,
+                "processed": job["status"],
+                "chunks_embedded": job["chunks_embedded"],
+                "chunks_total": job["chunks_total"],
+                "chunks_reused": job["chunks_reused"],
+                "error": job["error"]
+            }
+        
+        # Fall back to the database for jobs from a previous run
+        async with SessionLocal() as db:
+            result = await db.execute(
+                select(Document.processed).filter(Document.id == document_id)
+            )
+            document = result.first()
         
         if not document:
             raise ValueError("Document not found")
         
-        return document.content
+        return {
+            "document_id": document_id,
+            "processed": document.processed,
+            "chunks_embedded": None,
+            "chunks_total": None,
+            "chunks_reused": None,
+            "error": None
+        }
     
-    async def delete_document(self, document_id: str):
-        """Delete a document and its embeddings"""
-        db = next(get_db())
-        document = db.query(Document).filter(Document.id == document_id).first()
+    async def list_documents(self, limit: int = 100, cursor: Optional[str] = None,
+                             sort: str = "upload_date", order: str = "desc",
+                             status: Optional[str] = None, file_type: Optional[str] = None,
+                             uploaded_after: Optional[datetime] = None,
+                             uploaded_before: Optional[datetime] = None) -> Dict:
+        """List uploaded documents one page at a time, newest first by default"""
+        if sort not in self.SORT_COLUMNS:
+            raise ValueError(f"Unsupported sort field: {sort}")
+        if order not in ("asc", "desc"):
+            raise ValueError(f"Unsupported sort order: {order}")
+        limit = max(1, min(limit, self.MAX_PAGE_SIZE))
+        
+        sort_column = self.SORT_COLUMNS[sort]
+        descending = order == "desc"
+        
+        # Metadata columns only, never the extracted content
+        query = self._filter_documents(
+            select(
+                Document.id, Document.filename, Document.file_type,
+                Document.file_size, Document.upload_date, Document.processed
+            ),
+            status, file_type, uploaded_after, uploaded_before
+        )
+        
+        # Keyset pagination: continue strictly after the last (sort value, id) returned
+        if cursor:
+            value, last_id = self._decode_cursor(cursor, sort)
+            if descending:
+                query = query.filter(or_(
+                    sort_column < value, and_(sort_column == value, Document.id < last_id)
+                ))
+            else:
+                query = query.filter(or_(
+                    sort_column > value, and_(sort_column == value, Document.id > last_id)
+                ))
+        
+        if descending:
+            query = query.order_by(sort_column.desc(), Document.id.desc())
+        else:
+            query = query.order_by(sort_column.asc(), Document.id.asc())
+        
+        # One extra row tells whether another page exists
+        async with SessionLocal() as db:
+            result = await db.execute(query.limit(limit + 1))
+            documents = result.all()
+        
+        next_cursor = None
+        if len(documents) > limit:
+            documents = documents[:limit]
+            last = documents[-1]
+            next_cursor = self._encode_cursor(getattr(last, sort), last.id)
+        
+        return {
+            "documents": [
+                {
+                    "id": doc.id,
+                    "filename": doc.filename,
+                    "file_type": doc.file_type,
+                    "file_size": doc.file_size,
+                    "upload_date": doc.upload_date.isoformat(),
+                    "processed": doc.processed
+                }
+                for doc in documents
+            ],
+            "next_cursor": next_cursor
+        }
+    
+    async def count_documents(self, status: Optional[str] = None, file_type: Optional[str] = None,
+                              uploaded_after: Optional[datetime] = None,
+                              uploaded_before: Optional[datetime] = None) -> int:
+        """Count documents matching the listing filters"""
+        query = self._filter_documents(
+            select(func.count(Document.id)), status, file_type, uploaded_after, uploaded_before
+        )
+        
+        async with SessionLocal() as db:
+            return (await db.execute(query)).scalar_one()
+    
+    def _filter_documents(self, query, status: Optional[str], file_type: Optional[str],
+                          uploaded_after: Optional[datetime], uploaded_before: Optional[datetime]):
+        """Apply the listing filters to a documents query"""
+        if status:
+            query = query.filter(Document.processed == status)
+        if file_type:
+            query = query.filter(Document.file_type == file_type)
+        if uploaded_after:
+            query = query.filter(Document.upload_date >= uploaded_after)
+        if uploaded_before:
+            query = query.filter(Document.upload_date <= uploaded_before)
+        return query
+    
+    @staticmethod
+    def _encode_cursor(value, document_id: str) -> str:
+        """Opaque page cursor holding the last sort value and id"""
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        payload = json.dumps([value, document_id]).encode("utf-8")
+        return base64.urlsafe_b64encode(payload).decode("ascii")
+    
+    @staticmethod
+    def _decode_cursor(cursor: str, sort: str):
+        """Inverse of _encode_cursor, raising ValueError on a malformed cursor"""
+        try:
+            value, document_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            if sort == "upload_date":
+                value = datetime.fromisoformat(value)
+            return value, document_id
+        except Exception:
+            raise ValueError("Invalid cursor")
+    
+    async def get_document_content(self, document_id: str, offset: int = 0,
+                                   length: Optional[int] = None) -> Dict:
+        """Get a range of the extracted text of a document (all of it by default)"""
+        storage_id, total_length = await self._get_content_length(document_id)
+        content = await self.text_store.read(storage_id, offset, length)
+        
+        return {
+            "content": content,
+            "offset": offset,
+            "length": len(content),
+            "total_length": total_length
+        }
+    
+    async def iter_document_content(self, document_id: str, offset: int = 0,
+                                    length: Optional[int] = None) -> AsyncIterator[str]:
+        """Stream a range of the extracted text of a document segment by segment"""
+        storage_id, _ = await self._get_content_length(document_id)
+        async for part in self.text_store.iter_range(storage_id, offset, length):
+            yield part
+    
+    async def _get_content_length(self, document_id: str) -> Tuple[str, int]:
+        """Storage id and length of a document's extracted text, moving legacy inline text to the segment store"""
+        async with SessionLocal() as db:
+            result = await db.execute(
+                select(
+                    Document.storage_id, Document.content_length,
+                    Document.content.isnot(None).label("has_inline_content")
+                ).filter(Document.id == document_id)
+            )
+            document = result.first()
         
         if not document:
-            db.close()
             raise ValueError("Document not found")
         
-        # Remove from vector store
-        await self.vector_store.delete_document(document_id)
+        if document.content_length is None and document.has_inline_content:
+            async with SessionLocal() as db:
+                result = await db.execute(select(Document.content).filter(Document.id == document_id))
+                content = result.scalar_one()
+            
+            await self.text_store.put(document_id, content)
+            async with session_scope() as db:
+                await db.execute(
+                    update(Document).filter(Document.id == document_id).values(
+                        content_length=len(content), content=None
+                    )
+                )
+            return document_id, len(content)
+        
+        return document.storage_id or document_id, document.content_length or 0
+    
+    async def delete_document(self, document_id: str):
+        """Delete a document, and its text, embeddings and file once no other document shares them"""
+        async with session_scope() as db:
+            result = await db.execute(
+                select(Document.storage_id).filter(Document.id == document_id)
+            )
+            document = result.first()
+            if not document:
+                raise ValueError("Document not found")
+            storage_id = document.storage_id or document_id
+            
+            await db.execute(delete(Document).filter(Document.id == document_id))
+            result = await db.execute(
+                select(func.count(Document.id)).filter(Document.storage_id == storage_id)
+            )
+            remaining_references = result.scalar_one()
+        
+        # A worker still ingesting it must not mark it completed or keep its chunks
+        self.ingestion.cancel(document_id)
+        
+        # Drop answers that may cite it
+        await self.registry.qa_cache.invalidate_document(document_id)
+        
+        if remaining_references:
+            return
         
-        # Remove file from disk
-        file_path = os.path.join(self.upload_dir, f"{document_id}_{document.filename}")
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        # Last reference: remove from vector store, text store and disk
+        await self.vector_store.delete_document(storage_id)
+        await self.text_store.delete(storage_id)
         
-        # Remove from database
-        db.delete(document)
-        db.commit()
-        db.close()
+        file_paths = await run_in_thread(glob.glob, os.path.join(glob.escape(self.upload_dir), f"{storage_id}_*"))
+        for file_path in file_paths:
+            await run_in_thread(os.remove, file_path)
     
-    async def search_documents(self, query: str, limit: int = 5) -> List[Dict]:
-        """Search for relevant documents using vector similarity"""
-        results = await self.vector_store.search(query, limit)
+    async def search_documents(self, query: str, limit: int = 5,
+                               document_id: Optional[Union[str, List[str]]] = None,
+                               **filters) -> List[SearchResult]:
+        """Search for relevant document chunks using vector similarity"""
+        # Chunks are stored once per storage id, shared by identical documents
+        requested = [document_id] if isinstance(document_id, str) else list(document_id or [])
+        storage_filter = None
+        if requested:
+            storage_ids = await self._storage_ids(requested)
+            if not storage_ids:
+                return []
+            storage_filter = list(dict.fromkeys(storage_id for storage_id, _ in storage_ids.values()))
+        
+        results = await self.vector_store.search(query, limit, document_id=storage_filter, **filters)
+        
+        # Report the requested document, or one document that currently references the storage
+        owners = {}
+        if requested:
+            for requested_id, (storage_id, filename) in storage_ids.items():
+                owners.setdefault(storage_id, (requested_id, filename))
+        else:
+            owners = await self._storage_owners({result.document_id for result in results})
+        
+        for result in results:
+            owner_id, owner_filename = owners.get(result.document_id, (result.document_id, None))
+            for chunk in [result, *result.neighbors]:
+                chunk.document_id = owner_id
+                chunk.filename = owner_filename or chunk.filename
         return results
+    
+    async def _storage_ids(self, document_ids: List[str]) -> Dict[str, Tuple[str, str]]:
+        """Map document ids to the storage id holding their chunks and their own filename"""
+        async with SessionLocal() as db:
+            result = await db.execute(
+                select(Document.id, Document.storage_id, Document.filename).filter(Document.id.in_(document_ids))
+            )
+            return {row.id: (row.storage_id or row.id, row.filename) for row in result.all()}
+    
+    async def _storage_owners(self, storage_ids) -> Dict[str, Tuple[str, str]]:
+        """Pick a referencing document for each storage id, preferring the original upload"""
+        if not storage_ids:
+            return {}
+        
+        async with SessionLocal() as db:
+            result = await db.execute(
+                select(Document.storage_id, Document.id, Document.filename).filter(
+                    Document.storage_id.in_(list(storage_ids))
+                ).order_by(Document.upload_date)
+            )
+            rows = result.all()
+        
+        owners = {}
+        for row in rows:
+            if row.storage_id not in owners or row.id == row.storage_id:
+                owners[row.storage_id] = (row.id, row.filename)
+        return owners
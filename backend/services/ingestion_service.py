@@ -0,0 +1,131 @@
+import os
+import asyncio
+from typing import Dict, List, Optional, Callable, Awaitable
+from datetime import datetime
+
+class IngestionQueueFull(Exception):
+    """Raised when the ingestion queue is at capacity"""
+    pass
+
+class IngestionCancelled(Exception):
+    """Raised when a job's document is deleted before ingestion finishes"""
+    pass
+
+class IngestionService:
+    """Bounded background worker pool for document ingestion jobs"""
+
+    def __init__(self, handler: Callable[..., Awaitable[None]]):
+        # handler(job) performs the actual ingestion and reports progress on the job
+        self.handler = handler
+        self.num_workers = int(os.getenv("INGESTION_WORKERS", "2"))
+        self.max_queue_size = int(os.getenv("INGESTION_QUEUE_SIZE", "50"))
+        self.max_job_history = int(os.getenv("INGESTION_JOB_HISTORY", "1000"))
+        self.queue: Optional[asyncio.Queue] = None
+        self.jobs: Dict[str, Dict] = {}
+        self._workers: List[asyncio.Task] = []
+
+    async def initialize(self):
+        """Start the worker pool"""
+        self.queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._workers = [
+            asyncio.create_task(self._worker()) for _ in range(self.num_workers)
+        ]
+
+    async def shutdown(self):
+        """Stop the worker pool"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def is_full(self) -> bool:
+        """Check whether a new job would be rejected"""
+        return self.queue is None or self.queue.full()
+
+    def submit(self, document_id: str, **params) -> Dict:
+        """Queue an ingestion job, raising IngestionQueueFull when at capacity"""
+        if self.queue is None:
+            raise IngestionQueueFull("Ingestion workers are not running")
+
+        job = self._new_job(document_id, params)
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise IngestionQueueFull("Ingestion queue is full, try again later")
+
+        self.jobs[document_id] = job
+        self._prune_jobs()
+        return job
+
+    async def enqueue(self, document_id: str, **params) -> Dict:
+        """Queue an ingestion job, waiting for room instead of rejecting it"""
+        if self.queue is None:
+            raise IngestionQueueFull("Ingestion workers are not running")
+
+        job = self._new_job(document_id, params)
+        self.jobs[document_id] = job
+        self._prune_jobs()
+        await self.queue.put(job)
+        return job
+
+    def _new_job(self, document_id: str, params: Dict) -> Dict:
+        """A queued job record, updated by the worker as it progresses"""
+        return {
+            "document_id": document_id,
+            "status": "pending",
+            "chunks_embedded": 0,
+            "chunks_total": 0,
+            "chunks_reused": 0,
+            "error": None,
+            "cancelled": False,
+            "queued_at": datetime.utcnow(),
+            "started_at": None,
+            "finished_at": None,
+            "params": params
+        }
+
+    def cancel(self, document_id: str):
+        """Flag an unfinished job so the worker discards its results"""
+        job = self.jobs.get(document_id)
+        if job and job["finished_at"] is None:
+            job["cancelled"] = True
+
+    def get_job(self, document_id: str) -> Optional[Dict]:
+        """Get the in-memory job for a document, if any"""
+        return self.jobs.get(document_id)
+
+    def _prune_jobs(self):
+        """Forget the oldest finished jobs once the history limit is reached"""
+        excess = len(self.jobs) - self.max_job_history
+        if excess <= 0:
+            return
+
+        finished = [
+            document_id for document_id, job in self.jobs.items()
+            if job["finished_at"] is not None
+        ]
+        for document_id in finished[:excess]:
+            del self.jobs[document_id]
+
+    async def _worker(self):
+        """Pull jobs off the queue until cancelled"""
+        while True:
+            job = await self.queue.get()
+            try:
+                if job["cancelled"]:
+                    raise IngestionCancelled("Document was deleted before processing")
+                job["status"] = "processing"
+                job["started_at"] = datetime.utcnow()
+                await self.handler(job)
+                job["status"] = "completed"
+            except asyncio.CancelledError:
+                raise
+            except IngestionCancelled as e:
+                job["status"] = "cancelled"
+                job["error"] = str(e)
+            except Exception as e:
+                job["status"] = "failed"
+                job["error"] = str(e)
+            finally:
+                job["finished_at"] = datetime.utcnow()
+                self.queue.task_done()
@@ -0,0 +1,156 @@
+import os
+import re
+import json
+import uuid
+import hashlib
+import numpy as np
+from typing import Dict, Optional
+from datetime import datetime
+from sqlalchemy import or_, select, update, delete
+from models.database import QARecord, SessionLocal, session_scope
+
+class QACache:
+    """Answer cache for /qa backed by QARecord, with exact and near-duplicate lookup"""
+
+    def __init__(self, vector_store):
+        self.vector_store = vector_store
+        self.enabled = os.getenv("QA_CACHE_ENABLED", "true").lower() == "true"
+        self.similarity_threshold = float(os.getenv("QA_CACHE_SIMILARITY", "0.95"))
+        self.max_candidates = int(os.getenv("QA_CACHE_CANDIDATES", "500"))
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(question: str) -> str:
+        """Case- and whitespace-insensitive form of a question"""
+        return re.sub(r"\s+", " ", question).strip().lower()
+
+    def _hash(self, question: str) -> str:
+        """Exact-match key for a question"""
+        return hashlib.sha256(self._normalize(question).encode("utf-8")).hexdigest()
+
+    async def lookup(self, question: str, document_id: Optional[str]) -> Optional[Dict]:
+        """Find a cached answer for the question within the same document scope"""
+        if not self.enabled:
+            return None
+
+        question_hash = self._hash(question)
+        record = await self._find_exact(question_hash, document_id)
+
+        if record is None and self.similarity_threshold < 1.0:
+            # Same text retrieval embeds, so the embedding cache serves it the second time
+            embedding = np.asarray(await self.vector_store.embed_query(question), dtype=np.float32)
+            record = await self._find_similar(embedding, document_id)
+
+        if record is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        await self._record_hit(record["id"])
+        return record
+
+    def _scope_filter(self, query, document_id: Optional[str]):
+        """Restrict a QARecord query to one document, or to all-document questions"""
+        if document_id:
+            return query.filter(QARecord.document_id == document_id)
+        return query.filter(QARecord.document_id.is_(None))
+
+    async def _find_exact(self, question_hash: str, document_id: Optional[str]) -> Optional[Dict]:
+        """Look up a record by question hash"""
+        async with SessionLocal() as db:
+            result = await db.execute(self._scope_filter(
+                select(QARecord.id, QARecord.answer, QARecord.sources, QARecord.confidence),
+                document_id
+            ).filter(QARecord.question_hash == question_hash).limit(1))
+            record = result.first()
+
+        return self._to_result(record) if record else None
+
+    async def _find_similar(self, embedding: np.ndarray, document_id: Optional[str]) -> Optional[Dict]:
+        """Find the most similar recent question above the similarity threshold"""
+        async with SessionLocal() as db:
+            result = await db.execute(self._scope_filter(
+                select(QARecord.id, QARecord.answer, QARecord.sources, QARecord.confidence,
+                       QARecord.question_embedding),
+                document_id
+            ).filter(
+                QARecord.question_embedding.isnot(None)
+            ).order_by(QARecord.timestamp.desc()).limit(self.max_candidates))
+            candidates = result.all()
+
+        candidates = [
+            candidate for candidate in candidates
+            if len(candidate.question_embedding) == embedding.nbytes
+        ]
+        if not candidates:
+            return None
+
+        # Cosine similarity against every candidate at once
+        matrix = np.frombuffer(
+            b"".join(candidate.question_embedding for candidate in candidates), dtype=np.float32
+        ).reshape(len(candidates), -1)
+        norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(embedding)
+        similarities = matrix @ embedding / np.where(norms == 0, 1, norms)
+
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            return None
+        return self._to_result(candidates[best])
+
+    def _to_result(self, record) -> Dict:
+        """Convert a record into a QA result"""
+        return {
+            "id": record.id,
+            "answer": record.answer,
+            "sources": json.loads(record.sources or "[]"),
+            "confidence": record.confidence or 0.0
+        }
+
+    async def _record_hit(self, record_id: str):
+        """Count a cache hit on a record"""
+        async with session_scope() as db:
+            await db.execute(
+                update(QARecord).filter(QARecord.id == record_id).values(
+                    hit_count=QARecord.hit_count + 1
+                )
+            )
+
+    async def store(self, question: str, document_id: Optional[str], result: Dict):
+        """Cache an answer"""
+        if not self.enabled or not result.get("sources"):
+            return
+
+        embedding = await self.vector_store.embed_query(question)
+
+        async with session_scope() as db:
+            db.add(QARecord(
+                id=str(uuid.uuid4()),
+                question=question,
+                answer=result["answer"],
+                document_id=document_id,
+                confidence=result["confidence"],
+                sources=json.dumps(result["sources"]),
+                timestamp=datetime.utcnow(),
+                question_hash=self._hash(question),
+                question_embedding=np.asarray(embedding, dtype=np.float32).tobytes(),
+                hit_count=0
+            ))
+
+    async def invalidate_document(self, document_id: str):
+        """Drop answers about a document and every all-document answer (the document set changed)"""
+        async with session_scope() as db:
+            await db.execute(delete(QARecord).filter(or_(
+                QARecord.document_id == document_id,
+                QARecord.document_id.is_(None)
+            )))
+
+    def stats(self) -> Dict:
+        """Hit/miss counters for monitoring"""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
@@ -1,115 +1,238 @@
 import os
-import openai
-from typing import Dict, List
-from services.document_service import DocumentService
-from utils.vector_store_light import VectorStoreLight
+import time
+from typing import Dict, List, Optional, AsyncIterator
+from services.document_service import DocumentService, DocumentBusy
+from services.registry import ServiceRegistry, get_registry
+from utils.context_builder import build_context
+from utils.vector_store_light import SearchResult
+from utils.reranker import dedupe_overlapping
 import json
 
 class QAService:
-    def __init__(self):
-        self.document_service = DocumentService()
-        self.vector_store = VectorStoreLight()
-        self.openai_client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    def __init__(self, document_service: DocumentService, registry: Optional[ServiceRegistry] = None):
+        self.registry = registry or get_registry()
+        self.document_service = document_service
+        self.vector_store = self.registry.vector_store
+        self.openai_client = self.registry.openai_client
+        self.qa_cache = self.registry.qa_cache
+        self.reranker = self.registry.reranker
+        self.min_similarity = float(os.getenv("QA_MIN_SIMILARITY", "0.0"))
+        self.document_top_k = int(os.getenv("QA_DOCUMENT_TOP_K", "8"))
+        self.general_top_k = int(os.getenv("QA_GENERAL_TOP_K", "3"))
+        self.context_tokens = int(os.getenv("QA_CONTEXT_TOKENS", "3000"))
+        # Roughly what the old top-3 x 1000 character context cost
+        self.general_context_tokens = int(os.getenv("QA_GENERAL_CONTEXT_TOKENS", "750"))
+        # Candidates retrieved for the reranker to choose from
+        self.rerank_candidates = int(os.getenv("RERANK_CANDIDATES", "20"))
     
     async def initialize(self):
         """Initialize the QA service"""
-        await self.vector_store.initialize()
+        await self.registry.initialize()
     
     async def ask_document_question(self, question: str, document_id: str) -> Dict:
         """Ask a question about a specific document"""
         try:
-            # Get document content
-            document_content = await self.document_service.get_document_content(document_id)
+            cached = await self.qa_cache.lookup(question, document_id)
+            if cached:
+                return self._cached_result(cached)
             
-            # Create context for the question
-            context = f"Document Content:\n{document_content}\n\nQuestion: {question}"
+            prepared = await self._prepare_document_question(question, document_id)
             
             # Generate answer using OpenAI
-            response = self.openai_client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a helpful assistant that answers questions based on the provided document content. Provide accurate, concise answers and cite relevant parts of the document when possible."
-                    },
-                    {
-                        "role": "user",
-                        "content": context
-                    }
-                ],
-                max_tokens=500,
-                temperature=0.3
-            )
+            answer = await self._complete(prepared["messages"])
             
-            answer = response.choices[0].message.content
-            confidence = 0.8  # Placeholder confidence score
-            
-            return {
+            result = {
                 "answer": answer,
-                "sources": [document_id],
-                "confidence": confidence
+                "sources": prepared["sources"],
+                "confidence": prepared["confidence"],
+                "cached": False
             }
+            await self.qa_cache.store(question, document_id, result)
+            return result
             
+        except (ValueError, DocumentBusy):
+            # Unknown or not yet processed document, reported as such by the API
+            raise
         except Exception as e:
             raise Exception(f"Error processing document question: {str(e)}")
     
     async def ask_general_question(self, question: str) -> Dict:
         """Ask a question about all uploaded documents"""
         try:
-            # Search for relevant documents
-            relevant_docs = await self.vector_store.search(question, limit=3)
-            
-            if not relevant_docs:
-                return {
-                    "answer": "I don't have enough information to answer your question. Please upload some documents first.",
-                    "sources": [],
-                    "confidence": 0.0
-                }
-            
-            # Create context from relevant documents
-            context_parts = []
-            sources = []
+            cached = await self.qa_cache.lookup(question, None)
+            if cached:
+                return self._cached_result(cached)
             
-            for doc in relevant_docs:
-                context_parts.append(f"Document: {doc['filename']}\nContent: {doc['content'][:1000]}...")
-                sources.append(doc['document_id'])
-            
-            context = "\n\n".join(context_parts)
-            full_context = f"Context from relevant documents:\n{context}\n\nQuestion: {question}"
+            prepared = await self._prepare_general_question(question)
+            if "answer" in prepared:
+                return {**prepared, "cached": False}
             
             # Generate answer using OpenAI
-            response = self.openai_client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a helpful assistant that answers questions based on the provided document context. Provide accurate, concise answers and cite which documents you used for your answer."
-                    },
-                    {
-                        "role": "user",
-                        "content": full_context
-                    }
-                ],
-                max_tokens=500,
-                temperature=0.3
-            )
-            
-            answer = response.choices[0].message.content
-            confidence = 0.7  # Placeholder confidence score
+            answer = await self._complete(prepared["messages"])
             
-            return {
+            result = {
                 "answer": answer,
-                "sources": sources,
-                "confidence": confidence
+                "sources": prepared["sources"],
+                "confidence": prepared["confidence"],
+                "cached": False
             }
+            await self.qa_cache.store(question, None, result)
+            return result
             
         except Exception as e:
             raise Exception(f"Error processing general question: {str(e)}")
     
+    def _cached_result(self, cached: Dict) -> Dict:
+        """Shape a cache hit as a QA result"""
+        return {
+            "answer": cached["answer"],
+            "sources": cached["sources"],
+            "confidence": cached["confidence"],
+            "cached": True
+        }
+    
+    async def stream_question(self, question: str, document_id: Optional[str] = None) -> AsyncIterator[Dict]:
+        """Answer a question, yielding answer tokens as they arrive and a final done event"""
+        started = time.perf_counter()
+        
+        cached = await self.qa_cache.lookup(question, document_id)
+        if cached:
+            # A cached answer is sent whole as a single token
+            yield {"type": "token", "content": cached["answer"]}
+            yield {"type": "done", "ttft_ms": (time.perf_counter() - started) * 1000, **self._cached_result(cached)}
+            return
+        
+        if document_id:
+            prepared = await self._prepare_document_question(question, document_id)
+        else:
+            prepared = await self._prepare_general_question(question)
+        
+        if "answer" in prepared:
+            # Nothing to ask the model, send the canned answer as a single token
+            yield {"type": "token", "content": prepared["answer"]}
+            yield {"type": "done", "ttft_ms": 0.0, "cached": False, **prepared}
+            return
+        
+        ttft_ms = None
+        parts = []
+        stream = await self.openai_client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=prepared["messages"],
+            max_tokens=500,
+            temperature=0.3,
+            stream=True
+        )
+        async for chunk in stream:
+            token = chunk.choices[0].delta.content if chunk.choices else None
+            if not token:
+                continue
+            if ttft_ms is None:
+                ttft_ms = (time.perf_counter() - started) * 1000
+            parts.append(token)
+            yield {"type": "token", "content": token}
+        
+        result = {
+            "answer": "".join(parts),
+            "sources": prepared["sources"],
+            "confidence": prepared["confidence"],
+            "cached": False
+        }
+        await self.qa_cache.store(question, document_id, result)
+        
+        yield {"type": "done", "ttft_ms": ttft_ms, **result}
+    
+    async def _prepare_document_question(self, question: str, document_id: str) -> Dict:
+        """Retrieve context and build the prompt for a single-document question"""
+        status = await self.document_service.get_ingestion_status(document_id)
+        if status["processed"] != "completed":
+            raise DocumentBusy(f"Document is not ready for questions (status: {status['processed']})")
+        
+        # Retrieve the most relevant chunks of this document only
+        relevant_chunks = await self._retrieve(
+            question, self.document_top_k, document_id=document_id
+        )
+        
+        # Keep the prompt bounded however large the document is
+        document_context, _ = build_context(
+            relevant_chunks, self.context_tokens, in_document_order=True
+        )
+        context = f"Document Content:\n{document_context}\n\nQuestion: {question}"
+        
+        return {
+            "messages": [
+                {
+                    "role": "system",
+                    "content": "You are a helpful assistant that answers questions based on the provided document content. Provide accurate, concise answers and cite relevant parts of the document when possible."
+                },
+                {
+                    "role": "user",
+                    "content": context
+                }
+            ],
+            "sources": [document_id],
+            "confidence": 0.8  # Placeholder confidence score
+        }
+    
+    async def _prepare_general_question(self, question: str) -> Dict:
+        """Retrieve context and build the prompt for a question about all documents"""
+        # Search for relevant chunks
+        relevant_docs = await self._retrieve(
+            question, self.general_top_k, min_similarity=self.min_similarity
+        )
+        
+        if not relevant_docs:
+            return {
+                "answer": "I don't have enough information to answer your question. Please upload some documents first.",
+                "sources": [],
+                "confidence": 0.0
+            }
+        
+        # Pack the best chunks into the prompt, whole where the budget allows
+        context, selected = build_context(relevant_docs, self.general_context_tokens)
+        sources = list(dict.fromkeys(doc.document_id for doc in selected))
+        
+        full_context = f"Context from relevant documents:\n{context}\n\nQuestion: {question}"
+        
+        return {
+            "messages": [
+                {
+                    "role": "system",
+                    "content": "You are a helpful assistant that answers questions based on the provided document context. Provide accurate, concise answers and cite which documents you used for your answer."
+                },
+                {
+                    "role": "user",
+                    "content": full_context
+                }
+            ],
+            "sources": sources,
+            "confidence": 0.7  # Placeholder confidence score
+        }
+    
+    async def _retrieve(self, question: str, limit: int, **filters) -> List[SearchResult]:
+        """Search for chunks, reranking an over-fetched candidate pool when a reranker is configured"""
+        if self.reranker is None:
+            return await self.document_service.search_documents(question, limit=limit, **filters)
+        
+        candidates = await self.document_service.search_documents(
+            question, limit=max(limit, self.rerank_candidates), **filters
+        )
+        ranked = await self.reranker.rerank(question, candidates)
+        return dedupe_overlapping(ranked)[:limit]
+    
+    async def _complete(self, messages: List[Dict]) -> str:
+        """Generate a complete answer using OpenAI"""
+        response = await self.openai_client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=messages,
+            max_tokens=500,
+            temperature=0.3
+        )
+        return response.choices[0].message.content
+    
     async def get_related_questions(self, question: str) -> List[str]:
         """Generate related questions based on the input question"""
         try:
-            response = self.openai_client.chat.completions.create(
+            response = await self.openai_client.chat.completions.create(
                 model="gpt-3.5-turbo",
                 messages=[
                     {
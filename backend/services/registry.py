@@ -0,0 +1,50 @@
+import os
+import openai
+from typing import Optional
+from models.database import engine, SessionLocal, init_db
+from utils.embedding_backend import get_embedding_backend
+from utils.vector_store_light import get_vector_store
+from utils.reranker import get_reranker
+from utils.executors import shutdown_executors
+from services.qa_cache import QACache
+from services.text_store import TextStore
+
+class ServiceRegistry:
+    """Process-wide shared resources handed to every service"""
+
+    def __init__(self):
+        self.engine = engine
+        self.session_factory = SessionLocal
+        self.openai_client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.embedding_backend = get_embedding_backend(openai_client=self.openai_client)
+        self.vector_store = get_vector_store(embedding_backend=self.embedding_backend)
+        self.qa_cache = QACache(self.vector_store)
+        self.reranker = get_reranker()
+        self.text_store = TextStore()
+        self._initialized = False
+
+    async def initialize(self):
+        """Initialize shared resources once, however many services use them"""
+        if self._initialized:
+            return
+
+        await init_db()
+        await self.vector_store.initialize()
+        self._initialized = True
+
+    async def shutdown(self):
+        """Release shared resources"""
+        self.vector_store.close()
+        await self.openai_client.close()
+        await self.engine.dispose()
+        shutdown_executors()
+        self._initialized = False
+
+_registry: Optional[ServiceRegistry] = None
+
+def get_registry() -> ServiceRegistry:
+    """Get the process-wide service registry"""
+    global _registry
+    if _registry is None:
+        _registry = ServiceRegistry()
+    return _registry
@@ -0,0 +1,78 @@
+import os
+import zlib
+from typing import AsyncIterator, Dict, List, Optional
+from sqlalchemy import select, delete, insert
+from models.database import DocumentTextSegment, SessionLocal, session_scope
+from utils.executors import run_in_thread
+
+class TextStore:
+    """Extracted document text kept as zlib-compressed fixed-size segments, readable by range"""
+
+    def __init__(self, segment_chars: Optional[int] = None):
+        self.segment_chars = segment_chars or int(os.getenv("TEXT_SEGMENT_CHARS", "65536"))
+        self.compression_level = int(os.getenv("TEXT_COMPRESSION_LEVEL", "6"))
+
+    def _compress(self, text: str) -> List[Dict]:
+        """Split text into segments and compress each one (blocking)"""
+        return [
+            {
+                "segment_index": i,
+                "start_offset": start,
+                "end_offset": min(start + self.segment_chars, len(text)),
+                "data": zlib.compress(text[start:start + self.segment_chars].encode("utf-8"), self.compression_level)
+            }
+            for i, start in enumerate(range(0, len(text), self.segment_chars))
+        ]
+
+    async def put(self, document_id: str, text: str):
+        """Store (or replace) the text of a document"""
+        segments = await run_in_thread(self._compress, text)
+
+        async with session_scope() as db:
+            await db.execute(delete(DocumentTextSegment).filter(DocumentTextSegment.document_id == document_id))
+            if segments:
+                await db.execute(insert(DocumentTextSegment), [
+                    {"document_id": document_id, **segment} for segment in segments
+                ])
+
+    async def read(self, document_id: str, offset: int = 0, length: Optional[int] = None) -> str:
+        """Read length characters starting at offset (to the end when length is None)"""
+        return "".join([part async for part in self.iter_range(document_id, offset, length)])
+
+    async def iter_range(self, document_id: str, offset: int = 0, length: Optional[int] = None,
+                         segments_per_read: int = 8) -> AsyncIterator[str]:
+        """Yield a character range piece by piece, loading only the segments it overlaps"""
+        end = None if length is None else offset + length
+        position = offset
+
+        while end is None or position < end:
+            query = select(
+                DocumentTextSegment.start_offset, DocumentTextSegment.end_offset, DocumentTextSegment.data
+            ).filter(
+                DocumentTextSegment.document_id == document_id,
+                DocumentTextSegment.end_offset > position
+            )
+            if end is not None:
+                query = query.filter(DocumentTextSegment.start_offset < end)
+
+            async with SessionLocal() as db:
+                result = await db.execute(
+                    query.order_by(DocumentTextSegment.start_offset).limit(segments_per_read)
+                )
+                rows = result.all()
+
+            if not rows:
+                return
+
+            for row in rows:
+                text = zlib.decompress(row.data).decode("utf-8")
+                lower = max(position - row.start_offset, 0)
+                upper = len(text) if end is None else min(end - row.start_offset, len(text))
+                if lower < upper:
+                    yield text[lower:upper]
+            position = rows[-1].end_offset
+
+    async def delete(self, document_id: str):
+        """Remove the text of a document"""
+        async with session_scope() as db:
+            await db.execute(delete(DocumentTextSegment).filter(DocumentTextSegment.document_id == document_id))
@@ -0,0 +1,218 @@
+import os
+import re
+import math
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+from typing import List, Optional, Tuple
+
+# Words in any script, plus identifiers joined by - _ . / (part numbers, versions, file names)
+_TOKEN = re.compile(r"[^\W_]+(?:[-_./][^\W_]+)*")
+
+# Han, Hiragana, Katakana and Hangul, written without spaces between words
+_CJK = re.compile(
+    "[\u1100-\u11ff\u3040-\u30ff\u3130-\u318f\u3400-\u4dbf"
+    "\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\U00020000-\U0002fa1f]+"
+)
+
+# Bumped whenever tokenize() changes, so indexes built with the old terms are rebuilt
+TOKENIZER_VERSION = 3
+
+def tokenize(text: str) -> List[str]:
+    """Case-folded terms; compound identifiers are indexed whole and by their parts"""
+    terms = []
+    text = unicodedata.normalize("NFKC", text).casefold()
+    has_cjk = _CJK.search(text) is not None
+    for match in _TOKEN.finditer(text):
+        token = match.group()
+        if has_cjk and _CJK.search(token):
+            _add_cjk_terms(token, terms)
+        else:
+            _add_terms(token, terms)
+    return terms
+
+def _add_terms(token: str, terms: List[str]):
+    """A word or identifier, plus the parts of a compound identifier"""
+    terms.append(token)
+    if not token.isalnum():
+        terms.extend(part for part in re.split(r"[-_./]", token) if part)
+
+def _add_cjk_terms(token: str, terms: List[str]):
+    """CJK runs as overlapping character bigrams, any other text in the token as usual"""
+    position = 0
+    for run in _CJK.finditer(token):
+        for match in _TOKEN.finditer(token[position:run.start()]):
+            _add_terms(match.group(), terms)
+        chars = run.group()
+        if len(chars) == 1:
+            terms.append(chars)
+        else:
+            terms.extend(chars[i:i + 2] for i in range(len(chars) - 1))
+        position = run.end()
+    for match in _TOKEN.finditer(token[position:]):
+        _add_terms(match.group(), terms)
+
+class BM25Index:
+    """On-disk inverted index over stored chunks, scored with Okapi BM25"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv("KEYWORD_INDEX_PATH", "./keyword_index.db")
+        self.k1 = float(os.getenv("BM25_K1", "1.2"))
+        self.b = float(os.getenv("BM25_B", "0.75"))
+        # Terms in more than this fraction of chunks carry almost no signal and are skipped
+        self.max_df_ratio = float(os.getenv("BM25_MAX_DF_RATIO", "0.5"))
+        self._lock = threading.Lock()
+        self._conn = None
+        self._chunk_count = 0
+        self._total_length = 0
+
+    def initialize(self):
+        """Open (or create) the index"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(f"PRAGMA cache_size=-{int(os.getenv('KEYWORD_INDEX_CACHE_MB', '64')) * 1024}")
+        # Postings refer to chunks by integer key; chunk ids are long and would dominate the index size
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "id INTEGER PRIMARY KEY, chunk_id TEXT NOT NULL UNIQUE, "
+            "document_id TEXT NOT NULL, length INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_chunks_document_id ON chunks (document_id)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS postings ("
+            "term TEXT NOT NULL, chunk INTEGER NOT NULL, tf INTEGER NOT NULL, "
+            "PRIMARY KEY (term, chunk)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_postings_chunk ON postings (chunk)")
+
+        # Terms from another tokenizer version would never match; empty the index to be backfilled
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] != TOKENIZER_VERSION:
+            self._conn.execute("DELETE FROM postings")
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute(f"PRAGMA user_version = {TOKENIZER_VERSION}")
+        self._conn.commit()
+
+        self._chunk_count, self._total_length = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunks"
+        ).fetchone()
+
+    def count(self) -> int:
+        """Number of indexed chunks"""
+        return self._chunk_count
+
+    def add(self, document_id: str, chunk_ids: List[str], texts: List[str]):
+        """Index chunks (replacing any with the same ids)"""
+        if not chunk_ids:
+            return
+
+        with self._lock:
+            self._delete_chunks(chunk_ids)
+
+            posting_rows = []
+            for chunk_id, text in zip(chunk_ids, texts):
+                terms = Counter(tokenize(text))
+                length = sum(terms.values())
+                chunk = self._conn.execute(
+                    "INSERT INTO chunks (chunk_id, document_id, length) VALUES (?, ?, ?)",
+                    (chunk_id, document_id, length)
+                ).lastrowid
+                posting_rows.extend((term, chunk, tf) for term, tf in terms.items())
+                self._chunk_count += 1
+                self._total_length += length
+
+            # Inserting in key order keeps B-tree writes local
+            posting_rows.sort()
+            self._conn.executemany(
+                "INSERT INTO postings (term, chunk, tf) VALUES (?, ?, ?)", posting_rows
+            )
+            self._conn.commit()
+
+    def delete(self, chunk_ids: List[str]):
+        """Remove chunks from the index"""
+        if not chunk_ids:
+            return
+
+        with self._lock:
+            self._delete_chunks(chunk_ids)
+            self._conn.commit()
+
+    def delete_document(self, document_id: str):
+        """Remove every chunk of a document"""
+        with self._lock:
+            chunk_ids = [
+                row[0] for row in self._conn.execute(
+                    "SELECT chunk_id FROM chunks WHERE document_id = ?", (document_id,)
+                )
+            ]
+            self._delete_chunks(chunk_ids)
+            self._conn.commit()
+
+    def _delete_chunks(self, chunk_ids: List[str]):
+        """Delete chunk rows and postings, keeping corpus statistics in step (lock held)"""
+        for start in range(0, len(chunk_ids), 500):
+            batch = chunk_ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                f"SELECT id, length FROM chunks WHERE chunk_id IN ({placeholders})", batch
+            ).fetchall()
+            if not rows:
+                continue
+            keys = [row[0] for row in rows]
+            key_placeholders = ",".join("?" * len(keys))
+            self._conn.execute(f"DELETE FROM postings WHERE chunk IN ({key_placeholders})", keys)
+            self._conn.execute(f"DELETE FROM chunks WHERE id IN ({key_placeholders})", keys)
+            self._chunk_count -= len(rows)
+            self._total_length -= sum(row[1] for row in rows)
+
+    def search(self, query: str, limit: int = 10,
+               document_ids: Optional[List[str]] = None) -> List[Tuple[str, float]]:
+        """Top chunks for a query as (chunk_id, BM25 score), best first"""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or not self._chunk_count:
+            return []
+
+        with self._lock:
+            placeholders = ",".join("?" * len(terms))
+            document_frequency = dict(self._conn.execute(
+                f"SELECT term, COUNT(*) FROM postings WHERE term IN ({placeholders}) GROUP BY term",
+                terms
+            ).fetchall())
+
+            # Drop near-universal terms unless nothing else matched
+            informative = [
+                term for term, df in document_frequency.items()
+                if df <= self.max_df_ratio * self._chunk_count
+            ] or list(document_frequency)
+            if not informative:
+                return []
+
+            # Score in SQL so only the top chunks leave the database
+            average_length = self._total_length / self._chunk_count
+            weights = []
+            for term in informative:
+                df = document_frequency[term]
+                weights.extend((term, math.log(1 + (self._chunk_count - df + 0.5) / (df + 0.5))))
+            sql = (
+                f"WITH q(term, idf) AS (VALUES {','.join(['(?, ?)'] * len(informative))}) "
+                "SELECT c.chunk_id, SUM(q.idf * p.tf * (? + 1) / "
+                "(p.tf + ? * (1 - ? + ? * c.length / ?))) AS score "
+                "FROM q JOIN postings p ON p.term = q.term JOIN chunks c ON c.id = p.chunk"
+            )
+            params: List = weights + [self.k1, self.k1, self.b, self.b, average_length]
+            if document_ids:
+                sql += f" WHERE c.document_id IN ({','.join('?' * len(document_ids))})"
+                params.extend(document_ids)
+            sql += " GROUP BY p.chunk ORDER BY score DESC LIMIT ?"
+            params.append(limit)
+            return [tuple(row) for row in self._conn.execute(sql, params).fetchall()]
+
+    def close(self):
+        """Close the index"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,122 @@
+import os
+import re
+import zlib
+from collections import deque
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple
+from utils.tokens import count_tokens
+
+# A unit ends after sentence punctuation (plus closing quotes/brackets) or a blank line
+_BOUNDARY = re.compile(r'[.!?]+["\')\]]*\s+|\n\s*\n\s*')
+_WORD = re.compile(r'\S+\s*')
+
+@dataclass
+class Chunk:
+    """A piece of source text with its [start, end) character offsets"""
+    text: str
+    start: int
+    end: int
+
+class TextChunker:
+    """Token-bounded chunker that breaks on sentence and paragraph boundaries
+
+    Besides the size limit, a chunk that is at least half full also ends after an
+    anchor unit, chosen by a hash of the unit's text. Boundaries then depend on local
+    content rather than on everything before them, so an edit only changes the chunks
+    around it and re-indexing can reuse the rest.
+    """
+
+    def __init__(self, max_tokens: Optional[int] = None, overlap_tokens: Optional[int] = None,
+                 anchor_modulus: Optional[int] = None):
+        self.max_tokens = max_tokens or int(os.getenv("CHUNK_TOKENS", "400"))
+        self.overlap_tokens = overlap_tokens if overlap_tokens is not None else int(os.getenv("CHUNK_OVERLAP_TOKENS", "50"))
+        # On average one unit in anchor_modulus is an anchor (0 disables anchors)
+        self.anchor_modulus = anchor_modulus if anchor_modulus is not None else int(os.getenv("CHUNK_ANCHOR_MODULUS", "8"))
+        if self.overlap_tokens >= self.max_tokens:
+            raise ValueError("Chunk overlap must be smaller than the chunk size")
+
+    def split(self, text: str) -> List[Chunk]:
+        """Split text into a list of chunks"""
+        return list(self.iter_chunks(text))
+
+    def iter_chunks(self, text: str) -> Iterator[Chunk]:
+        """Yield chunks in order, in a single linear pass over the text"""
+        window: deque = deque()  # (start, end, tokens) units in the current chunk
+        window_tokens = 0
+
+        for unit in self._iter_units(text):
+            if window and window_tokens + unit[2] > self.max_tokens:
+                chunk = self._make_chunk(text, window[0][0], window[-1][1])
+                if chunk:
+                    yield chunk
+
+                # Carry trailing units over as overlap
+                while window and window_tokens > self.overlap_tokens:
+                    window_tokens -= window.popleft()[2]
+                # Never let the overlap alone push the next chunk past the limit
+                while window and window_tokens + unit[2] > self.max_tokens:
+                    window_tokens -= window.popleft()[2]
+
+            window.append(unit)
+            window_tokens += unit[2]
+
+            if window_tokens * 2 >= self.max_tokens and self._is_anchor(text, unit):
+                chunk = self._make_chunk(text, window[0][0], window[-1][1])
+                if chunk:
+                    yield chunk
+
+                while window and window_tokens > self.overlap_tokens:
+                    window_tokens -= window.popleft()[2]
+
+        if window:
+            chunk = self._make_chunk(text, window[0][0], window[-1][1])
+            if chunk:
+                yield chunk
+
+    def _is_anchor(self, text: str, unit: Tuple[int, int, int]) -> bool:
+        """Whether a chunk may end after this unit, decided by its content alone"""
+        if not self.anchor_modulus:
+            return False
+        content = text[unit[0]:unit[1]].strip().encode("utf-8")
+        return zlib.crc32(content) % self.anchor_modulus == 0
+
+    def _iter_units(self, text: str) -> Iterator[Tuple[int, int, int]]:
+        """Yield sentence/paragraph units as (start, end, tokens)"""
+        start = 0
+        for match in _BOUNDARY.finditer(text):
+            yield from self._sized_units(text, start, match.end())
+            start = match.end()
+
+        if start < len(text):
+            yield from self._sized_units(text, start, len(text))
+
+    def _sized_units(self, text: str, start: int, end: int) -> Iterator[Tuple[int, int, int]]:
+        """Yield a unit, splitting it on word boundaries if it alone exceeds the chunk size"""
+        tokens = count_tokens(text[start:end])
+        if tokens <= self.max_tokens:
+            yield (start, end, tokens)
+            return
+
+        piece_start = start
+        piece_tokens = 0
+        for word in _WORD.finditer(text, start, end):
+            word_tokens = count_tokens(word.group())
+            if piece_tokens and piece_tokens + word_tokens > self.max_tokens:
+                yield (piece_start, word.start(), piece_tokens)
+                piece_start = word.start()
+                piece_tokens = 0
+            piece_tokens += word_tokens
+
+        if piece_start < end:
+            yield (piece_start, end, piece_tokens)
+
+    def _make_chunk(self, text: str, start: int, end: int) -> Optional[Chunk]:
+        """Build a chunk with surrounding whitespace trimmed from its offsets"""
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+
+        if start == end:
+            return None
+        return Chunk(text=text[start:end], start=start, end=end)
@@ -0,0 +1,35 @@
+from typing import List, Tuple
+from utils.tokens import count_tokens, truncate_to_tokens
+from utils.vector_store_light import SearchResult
+
+# Don't bother appending a truncated chunk smaller than this
+MIN_PARTIAL_TOKENS = 50
+
+def build_context(results: List[SearchResult], max_tokens: int,
+                  in_document_order: bool = False) -> Tuple[str, List[SearchResult]]:
+    """Pack the highest ranked chunks into a prompt context within a token budget"""
+    selected = []
+    remaining = max_tokens
+
+    for result in results:
+        header = f"Document: {result.filename} (part {result.chunk_index + 1})\n"
+        cost = count_tokens(header) + count_tokens(result.content)
+
+        if cost <= remaining:
+            selected.append((result, result.content))
+            remaining -= cost
+        else:
+            # Fill what is left of the budget with the start of this chunk
+            room = remaining - count_tokens(header)
+            if room >= MIN_PARTIAL_TOKENS:
+                selected.append((result, truncate_to_tokens(result.content, room)))
+            break
+
+    if in_document_order:
+        selected.sort(key=lambda item: (item[0].document_id, item[0].chunk_index))
+
+    context = "\n\n".join(
+        f"Document: {result.filename} (part {result.chunk_index + 1})\n{content}"
+        for result, content in selected
+    )
+    return context, [result for result, _ in selected]
@@ -0,0 +1,92 @@
+import os
+import threading
+from typing import List, Dict, Optional
+import openai
+from utils.executors import run_in_thread
+
+class EmbeddingBackend:
+    """Interface for turning texts into embedding vectors"""
+
+    # Identifies the model; used in cache keys and collection metadata
+    name: str = ""
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed a batch of texts"""
+        raise NotImplementedError
+
+class OpenAIEmbeddingBackend(EmbeddingBackend):
+    """Embeddings from the OpenAI (or an OpenAI-compatible) API"""
+
+    def __init__(self, model: Optional[str] = None, client: Optional[openai.AsyncOpenAI] = None):
+        self.model = model or os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+        self.name = f"openai:{self.model}"
+        self.client = client or openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed a batch of texts in one API call"""
+        try:
+            response = await self.client.embeddings.create(model=self.model, input=texts)
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        except Exception as e:
+            raise Exception(f"Error getting embeddings from OpenAI: {str(e)}")
+
+# One SentenceTransformer per model name, shared by every backend in the process
+_local_models: Dict[str, object] = {}
+_local_models_lock = threading.Lock()
+
+def get_local_model(model_name: str):
+    """Load a SentenceTransformer model once per process"""
+    with _local_models_lock:
+        if model_name not in _local_models:
+            try:
+                import torch
+                from sentence_transformers import SentenceTransformer
+            except ImportError:
+                raise Exception(
+                    "Local embeddings require sentence-transformers: pip install sentence-transformers"
+                )
+
+            threads = int(os.getenv("EMBEDDING_THREADS", str(os.cpu_count() or 1)))
+            torch.set_num_threads(threads)
+            _local_models[model_name] = SentenceTransformer(model_name, device="cpu")
+
+        return _local_models[model_name]
+
+class LocalEmbeddingBackend(EmbeddingBackend):
+    """Embeddings computed on the CPU with a shared sentence-transformers model"""
+
+    def __init__(self, model: Optional[str] = None):
+        self.model = model or os.getenv("LOCAL_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+        self.name = f"local:{self.model}"
+        self.batch_size = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed a batch of texts with batched, multi-threaded CPU inference"""
+        try:
+            return await run_in_thread(self._encode, texts)
+        except Exception as e:
+            raise Exception(f"Error computing local embeddings: {str(e)}")
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        """Run the shared model (torch releases the GIL during inference)"""
+        model = get_local_model(self.model)
+        vectors = model.encode(
+            texts,
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        )
+        return vectors.tolist()
+
+def get_embedding_backend(backend: Optional[str] = None,
+                          openai_client: Optional[openai.AsyncOpenAI] = None) -> EmbeddingBackend:
+    """Create the embedding backend selected by EMBEDDING_BACKEND (openai or local)"""
+    backend = (backend or os.getenv("EMBEDDING_BACKEND", "openai")).lower()
+
+    if backend == "openai":
+        return OpenAIEmbeddingBackend(client=openai_client)
+    if backend == "local":
+        return LocalEmbeddingBackend()
+
+    raise ValueError(f"Unknown embedding backend: {backend}")
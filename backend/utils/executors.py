@@ -0,0 +1,81 @@
+import os
+import asyncio
+import multiprocessing
+from functools import partial
+from typing import Callable, Optional, TypeVar
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+T = TypeVar("T")
+
+# Blocking I/O (database, disk, client libraries) runs on threads,
+# CPU-bound parsing runs in separate processes so it doesn't hold the GIL
+_thread_pool: Optional[ThreadPoolExecutor] = None
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+def get_thread_pool() -> ThreadPoolExecutor:
+    """Shared thread pool for blocking I/O"""
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(
+            max_workers=int(os.getenv("IO_THREADS", "16")),
+            thread_name_prefix="io"
+        )
+    return _thread_pool
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Shared process pool for CPU-bound work"""
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(
+            max_workers=int(os.getenv("CPU_WORKERS", str(min(4, os.cpu_count() or 1)))),
+            mp_context=_process_context()
+        )
+    return _process_pool
+
+def _process_context():
+    """Start method for worker processes"""
+    # Forking a process that runs an event loop and I/O threads can copy held locks
+    # into the child, so workers start from a clean interpreter instead
+    default_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(os.getenv("PROCESS_START_METHOD", default_method))
+
+async def run_in_thread(func: Callable[..., T], *args, **kwargs) -> T:
+    """Run a blocking call on the I/O thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_thread_pool(), partial(func, *args, **kwargs))
+
+async def run_in_process(func: Callable[..., T], *args, **kwargs) -> T:
+    """Run a CPU-bound, picklable function on the process pool, retrying once if a worker died"""
+    loop = asyncio.get_running_loop()
+    call = partial(func, *args, **kwargs)
+    pool = get_process_pool()
+    try:
+        return await loop.run_in_executor(pool, call)
+    except BrokenProcessPool:
+        # A crashed or killed worker breaks the whole pool; replace it so later jobs still run
+        _discard_process_pool(pool)
+    
+    # Retry alone in a private worker, so a job that kills its worker fails only itself
+    isolated = ProcessPoolExecutor(max_workers=1, mp_context=_process_context())
+    try:
+        return await loop.run_in_executor(isolated, call)
+    finally:
+        isolated.shutdown(wait=False)
+
+def _discard_process_pool(pool: ProcessPoolExecutor):
+    """Drop a broken pool, unless another caller already replaced it"""
+    global _process_pool
+    if _process_pool is pool:
+        _process_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def shutdown_executors():
+    """Shut down both pools"""
+    global _thread_pool, _process_pool
+    if _thread_pool is not None:
+        _thread_pool.shutdown(wait=True)
+        _thread_pool = None
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=True)
+        _process_pool = None
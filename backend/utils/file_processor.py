@@ -1,11 +1,79 @@
 import os
+import asyncio
 import PyPDF2
 import docx
-from typing import List
+from typing import List, Iterator, Optional
+from dataclasses import dataclass, field
 import mimetypes
+from utils.executors import run_in_process, run_in_thread
+
+@dataclass
+class ExtractedText:
+    """Extracted document text with the start offset of each page (paged formats only)"""
+    text: str
+    page_offsets: List[int] = field(default_factory=list)
+
+def iter_pdf_pages(file_path: str, start: int = 0, stop: Optional[int] = None) -> Iterator[str]:
+    """Yield the text of each PDF page in [start, stop)"""
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        stop = len(pdf_reader.pages) if stop is None else stop
+        
+        for page_num in range(start, stop):
+            yield pdf_reader.pages[page_num].extract_text() or ""
+
+def extract_pdf_pages(file_path: str, start: int, stop: int) -> List[str]:
+    """Extract a range of PDF pages (runs inside a worker process)"""
+    return list(iter_pdf_pages(file_path, start, stop))
+
+def count_pdf_pages(file_path: str) -> int:
+    """Count the pages of a PDF"""
+    with open(file_path, 'rb') as file:
+        return len(PyPDF2.PdfReader(file).pages)
+
+def read_docx(file_path: str) -> str:
+    """Extract text from a DOCX file (runs inside a worker process)"""
+    doc = docx.Document(file_path)
+    return "".join(paragraph.text + "\n" for paragraph in doc.paragraphs)
+
+def read_txt(file_path: str) -> str:
+    """Read a text file, falling back to latin-1 for non UTF-8 input"""
+    try:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            return file.read()
+    except UnicodeDecodeError:
+        with open(file_path, 'r', encoding='latin-1') as file:
+            return file.read()
+
+def read_csv(file_path: str) -> str:
+    """Summarize a CSV file as readable text (runs inside a worker process)"""
+    import pandas as pd
+    df = pd.read_csv(file_path)
+    
+    # Convert DataFrame to readable text
+    parts = [
+        f"CSV Data with {len(df)} rows and {len(df.columns)} columns:\n\n",
+        "Columns: " + ", ".join(map(str, df.columns.tolist())) + "\n\n",
+        # Add first few rows as sample
+        "Sample data:\n",
+        df.head(10).to_string(index=False)
+    ]
+    return "".join(parts)
+
+def join_pages(pages: List[str]) -> ExtractedText:
+    """Join page texts, recording where each page starts"""
+    offsets = []
+    position = 0
+    for page in pages:
+        offsets.append(position)
+        position += len(page) + 1
+    
+    return ExtractedText(text="\n".join(pages), page_offsets=offsets)
 
 class FileProcessor:
     def __init__(self):
+        self.pdf_workers = int(os.getenv("PDF_WORKERS", os.getenv("CPU_WORKERS", str(min(4, os.cpu_count() or 1)))))
+        self.pdf_parallel_min_pages = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "16"))
         self.supported_types = {
             'application/pdf': self._process_pdf,
             'application/vnd.openxmlformats-officedocument.wordprocessingml.document': self._process_docx,
@@ -20,32 +88,57 @@ class FileProcessor:
     
     async def process_file(self, file_path: str) -> str:
         """Process a file and extract text content"""
+        extracted = await self.extract(file_path)
+        return extracted.text
+    
+    async def extract(self, file_path: str) -> ExtractedText:
+        """Extract text content along with page offsets where available"""
         try:
             mime_type, _ = mimetypes.guess_type(file_path)
             
             if mime_type not in self.supported_types:
                 raise ValueError(f"Unsupported file type: {mime_type}")
             
-            processor = self.supported_types[mime_type]
-            content = await processor(file_path)
+            if mime_type == 'application/pdf':
+                extracted = await self._extract_pdf(file_path)
+            else:
+                processor = self.supported_types[mime_type]
+                extracted = ExtractedText(text=await processor(file_path))
+            
+            # Strip surrounding whitespace, keeping page offsets aligned
+            leading = len(extracted.text) - len(extracted.text.lstrip())
+            text = extracted.text.strip()
+            offsets = [min(max(0, offset - leading), len(text)) for offset in extracted.page_offsets]
             
-            return content.strip()
+            return ExtractedText(text=text, page_offsets=offsets)
             
         except Exception as e:
             raise Exception(f"Error processing file {file_path}: {str(e)}")
     
     async def _process_pdf(self, file_path: str) -> str:
         """Extract text from PDF file"""
+        extracted = await self._extract_pdf(file_path)
+        return extracted.text
+    
+    async def _extract_pdf(self, file_path: str) -> ExtractedText:
+        """Extract PDF text page by page, spreading large PDFs across worker processes"""
         try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                
-                for page_num in range(len(pdf_reader.pages)):
-                    page = pdf_reader.pages[page_num]
-                    text += page.extract_text() + "\n"
-                
-                return text
+            page_count = await run_in_process(count_pdf_pages, file_path)
+            
+            workers = min(self.pdf_workers, page_count)
+            if workers <= 1 or page_count < self.pdf_parallel_min_pages:
+                pages = await run_in_process(extract_pdf_pages, file_path, 0, page_count)
+                return join_pages(pages)
+            
+            # One contiguous page range per worker, reassembled in order
+            step = -(-page_count // workers)
+            ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+            parts = await asyncio.gather(*[
+                run_in_process(extract_pdf_pages, file_path, start, stop)
+                for start, stop in ranges
+            ])
+            
+            return join_pages([page for part in parts for page in part])
                 
         except Exception as e:
             raise Exception(f"Error reading PDF: {str(e)}")
@@ -53,13 +146,7 @@ class FileProcessor:
     async def _process_docx(self, file_path: str) -> str:
         """Extract text from DOCX file"""
         try:
-            doc = docx.Document(file_path)
-            text = ""
-            
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-            
-            return text
+            return await run_in_process(read_docx, file_path)
             
         except Exception as e:
             raise Exception(f"Error reading DOCX: {str(e)}")
@@ -67,34 +154,14 @@ class FileProcessor:
     async def _process_txt(self, file_path: str) -> str:
         """Read text from TXT file"""
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                return file.read()
-                
-        except UnicodeDecodeError:
-            # Try with different encoding
-            try:
-                with open(file_path, 'r', encoding='latin-1') as file:
-                    return file.read()
-            except Exception as e:
-                raise Exception(f"Error reading text file: {str(e)}")
+            return await run_in_thread(read_txt, file_path)
         except Exception as e:
             raise Exception(f"Error reading text file: {str(e)}")
     
     async def _process_csv(self, file_path: str) -> str:
         """Convert CSV to readable text format"""
         try:
-            import pandas as pd
-            df = pd.read_csv(file_path)
-            
-            # Convert DataFrame to readable text
-            text = f"CSV Data with {len(df)} rows and {len(df.columns)} columns:\n\n"
-            text += "Columns: " + ", ".join(df.columns.tolist()) + "\n\n"
-            
-            # Add first few rows as sample
-            text += "Sample data:\n"
-            text += df.head(10).to_string(index=False)
-            
-            return text
+            return await run_in_process(read_csv, file_path)
             
         except Exception as e:
             # Fallback to basic text reading
@@ -0,0 +1,170 @@
+import os
+import math
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+from utils.bm25_index import tokenize
+from utils.executors import run_in_thread
+from utils.vector_store_light import SearchResult
+
+class Reranker:
+    """Interface for reordering retrieved chunks by relevance to a query"""
+
+    name: str = ""
+
+    async def rerank(self, query: str, results: List[SearchResult]) -> List[SearchResult]:
+        """Return the results best first, with score set to the reranker's score"""
+        raise NotImplementedError
+
+class LexicalReranker(Reranker):
+    """Reranks by BM25 and phrase matches within the candidate pool, with the retrieval order as a prior"""
+
+    name = "lexical"
+
+    def __init__(self):
+        self.k1 = float(os.getenv("BM25_K1", "1.2"))
+        self.b = float(os.getenv("BM25_B", "0.75"))
+        # Weight of the retrieval rank next to the lexical score (both scaled to 0..1)
+        self.prior_weight = float(os.getenv("RERANK_PRIOR_WEIGHT", "0.3"))
+
+    async def rerank(self, query: str, results: List[SearchResult]) -> List[SearchResult]:
+        """Score the pool lexically, breaking near ties by retrieval rank (cheap enough to run inline)"""
+        query_terms = tokenize(query)
+        if not results or not query_terms:
+            return results
+
+        tokenized = [tokenize(result.content) for result in results]
+        documents = [Counter(tokens) for tokens in tokenized]
+        average_length = sum(len(tokens) for tokens in tokenized) / len(tokenized) or 1
+        idf = {}
+        for term in set(query_terms):
+            df = sum(1 for terms in documents if term in terms)
+            idf[term] = math.log(1 + (len(documents) - df + 0.5) / (df + 0.5))
+        bigrams = list(zip(query_terms, query_terms[1:]))
+
+        lexical = []
+        for tokens, terms in zip(tokenized, documents):
+            score = 0.0
+            for term in idf:
+                tf = terms.get(term, 0)
+                if tf:
+                    norm = tf + self.k1 * (1 - self.b + self.b * len(tokens) / average_length)
+                    score += idf[term] * tf * (self.k1 + 1) / norm
+            if bigrams:
+                # Query terms appearing next to each other, as in the question
+                pairs = set(zip(tokens, tokens[1:]))
+                score += sum(idf[first] + idf[second] for first, second in bigrams if (first, second) in pairs)
+            lexical.append(score)
+
+        best = max(lexical) or 1.0
+        for rank, (result, score) in enumerate(zip(results, lexical)):
+            result.score = score / best + self.prior_weight * (1 - rank / len(results))
+        return sorted(results, key=lambda result: result.score, reverse=True)
+
+# One CrossEncoder per model name, shared across the process
+_cross_encoders: Dict[str, object] = {}
+_cross_encoders_lock = threading.Lock()
+
+def get_cross_encoder(model_name: str):
+    """Load a sentence-transformers CrossEncoder once per process"""
+    with _cross_encoders_lock:
+        if model_name not in _cross_encoders:
+            try:
+                from sentence_transformers import CrossEncoder
+            except ImportError:
+                raise Exception(
+                    "Cross-encoder reranking requires sentence-transformers: pip install sentence-transformers"
+                )
+
+            _cross_encoders[model_name] = CrossEncoder(model_name, device="cpu")
+
+        return _cross_encoders[model_name]
+
+class CrossEncoderReranker(Reranker):
+    """Reranks with a small cross-encoder run on the CPU"""
+
+    def __init__(self, model: Optional[str] = None):
+        self.model = model or os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+        self.name = f"cross-encoder:{self.model}"
+        self.batch_size = int(os.getenv("RERANK_BATCH_SIZE", "32"))
+
+    async def rerank(self, query: str, results: List[SearchResult]) -> List[SearchResult]:
+        """Score every (query, chunk) pair with the model"""
+        if not results:
+            return results
+
+        try:
+            scores = await run_in_thread(self._predict, query, [result.content for result in results])
+        except Exception as e:
+            raise Exception(f"Error reranking with cross-encoder: {str(e)}")
+
+        for result, score in zip(results, scores):
+            result.score = float(score)
+        return sorted(results, key=lambda result: result.score, reverse=True)
+
+    def _predict(self, query: str, texts: List[str]) -> List[float]:
+        """Run the shared model (blocking)"""
+        model = get_cross_encoder(self.model)
+        return model.predict(
+            [(query, text) for text in texts],
+            batch_size=self.batch_size,
+            show_progress_bar=False
+        ).tolist()
+
+def get_reranker(reranker: Optional[str] = None) -> Optional[Reranker]:
+    """Create the reranker selected by RERANKER (none, lexical or cross-encoder)"""
+    reranker = (reranker or os.getenv("RERANKER", "lexical")).lower()
+
+    if reranker == "none":
+        return None
+    if reranker == "lexical":
+        return LexicalReranker()
+    if reranker == "cross-encoder":
+        return CrossEncoderReranker()
+
+    raise ValueError(f"Unknown reranker: {reranker}")
+
+def dedupe_overlapping(results: List[SearchResult], max_overlap: Optional[float] = None) -> List[SearchResult]:
+    """Drop repeated or mostly overlapping chunks, keeping the better ranked one
+
+    A chunk that only partly overlaps a better ranked chunk of the same document
+    keeps its non-overlapping text, so overlap regions are sent once.
+    """
+    max_overlap = max_overlap if max_overlap is not None else float(os.getenv("RERANK_MAX_OVERLAP", "0.5"))
+    kept: List[SearchResult] = []
+    seen_text = set()
+    spans: Dict[str, List[tuple]] = {}
+
+    for result in results:
+        text = " ".join(result.content.split())
+        if text in seen_text:
+            continue
+
+        start, end = result.start_offset, result.end_offset
+        if start is None or end is None or end - start != len(result.content):
+            seen_text.add(text)
+            kept.append(result)
+            continue
+
+        covered = spans.setdefault(result.document_id, [])
+        overlap = sum(max(0, min(end, other_end) - max(start, other_start)) for other_start, other_end in covered)
+        if overlap > max_overlap * (end - start):
+            continue
+
+        if overlap:
+            # Trim text already covered by a kept chunk at either edge
+            for other_start, other_end in covered:
+                if other_start <= start < other_end:
+                    start = other_end
+                if other_start < end <= other_end:
+                    end = other_start
+            if end <= start:
+                continue
+            result.content = result.content[start - result.start_offset:end - result.start_offset]
+            result.start_offset, result.end_offset = start, end
+
+        covered.append((start, end))
+        seen_text.add(text)
+        kept.append(result)
+
+    return kept
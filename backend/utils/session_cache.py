@@ -0,0 +1,108 @@
+import os
+import time
+import asyncio
+import weakref
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional
+
+class SessionHistoryCache:
+    """Bounded per-session ring buffers of recent chat messages and rolling summaries, evicted by LRU and idle TTL"""
+
+    def __init__(self, max_sessions: Optional[int] = None, max_messages: Optional[int] = None,
+                 ttl_seconds: Optional[float] = None):
+        self.max_sessions = max_sessions or int(os.getenv("SESSION_CACHE_SESSIONS", "1000"))
+        self.max_messages = max_messages or int(os.getenv("SESSION_CACHE_MESSAGES", "20"))
+        self.ttl_seconds = ttl_seconds or float(os.getenv("SESSION_CACHE_TTL", "1800"))
+        self._sessions: "OrderedDict[str, deque]" = OrderedDict()
+        self._last_used: Dict[str, float] = {}
+        self._summaries: Dict[str, Dict] = {}
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self.hits = 0
+        self.misses = 0
+
+    def lock(self, session_id: str) -> asyncio.Lock:
+        """Per-session lock that serializes cold loads with write-throughs"""
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[session_id] = lock
+        return lock
+
+    def get(self, session_id: str, limit: Optional[int] = None) -> Optional[List[Dict]]:
+        """Most recent messages of a cached session, oldest first, or None on a miss"""
+        self._expire()
+        buffer = self._sessions.get(session_id)
+        if buffer is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._touch(session_id)
+        messages = list(buffer)
+        return messages[-limit:] if limit else messages
+
+    def get_summary(self, session_id: str) -> Optional[Dict]:
+        """Rolling summary of a cached session, if it has one"""
+        return self._summaries.get(session_id)
+
+    def load(self, session_id: str, messages: List[Dict], summary: Optional[Dict] = None):
+        """Install the recent history and summary read from the database, oldest first"""
+        self._sessions[session_id] = deque(messages, maxlen=self.max_messages)
+        self.set_summary(session_id, summary)
+        self._touch(session_id)
+        self._evict_overflow()
+
+    def set_summary(self, session_id: str, summary: Optional[Dict]):
+        """Replace the rolling summary of a cached session"""
+        if summary is None:
+            self._summaries.pop(session_id, None)
+        elif session_id in self._sessions:
+            self._summaries[session_id] = summary
+
+    def append(self, session_id: str, messages: List[Dict], create: bool = False):
+        """Write-through of newly stored messages; only cached (or newly created) sessions are kept"""
+        buffer = self._sessions.get(session_id)
+        if buffer is None:
+            if not create:
+                return
+            buffer = self._sessions[session_id] = deque(maxlen=self.max_messages)
+
+        buffer.extend(messages)
+        self._touch(session_id)
+        self._evict_overflow()
+
+    def evict(self, session_id: str):
+        """Drop a session from the cache"""
+        self._sessions.pop(session_id, None)
+        self._last_used.pop(session_id, None)
+        self._summaries.pop(session_id, None)
+
+    def _touch(self, session_id: str):
+        """Mark a session as most recently used"""
+        self._sessions.move_to_end(session_id)
+        self._last_used[session_id] = time.monotonic()
+
+    def _evict_overflow(self):
+        """Drop least recently used sessions past the size bound"""
+        while len(self._sessions) > self.max_sessions:
+            self.evict(next(iter(self._sessions)))
+
+    def _expire(self):
+        """Drop sessions idle for longer than the TTL (the LRU end is the oldest)"""
+        cutoff = time.monotonic() - self.ttl_seconds
+        while self._sessions:
+            session_id = next(iter(self._sessions))
+            if self._last_used[session_id] >= cutoff:
+                break
+            self.evict(session_id)
+
+    def stats(self) -> Dict:
+        """Hit/miss counters for monitoring"""
+        lookups = self.hits + self.misses
+        return {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
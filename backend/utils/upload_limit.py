@@ -0,0 +1,70 @@
+import re
+from typing import Pattern
+from starlette.responses import JSONResponse
+
+class _BodyTooLarge(Exception):
+    """Raised inside the request when the streamed body passes the limit"""
+    pass
+
+class UploadSizeLimitMiddleware:
+    """Rejects oversized upload bodies with 413 before they are parsed or spooled to disk"""
+
+    # Room for the multipart boundaries and part headers around the file itself
+    MULTIPART_OVERHEAD = 64 * 1024
+
+    def __init__(self, app, max_size: int, paths: str = r"^/upload$|^/documents/[^/]+$"):
+        self.app = app
+        self.max_size = max_size
+        self.limit = max_size + self.MULTIPART_OVERHEAD
+        self.paths: Pattern = re.compile(paths)
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in ("POST", "PUT")
+            or not self.paths.match(scope["path"])
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        # Declared size: refuse without reading any of the body
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.limit:
+            await self._reject(scope, receive, send)
+            return
+
+        # Chunked or understated bodies: stop reading once the limit is passed
+        received = 0
+        exceeded = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.limit:
+                    exceeded = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def guarded_send(message):
+            # The app's own error response for the aborted body is replaced by the 413
+            if not exceeded:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except _BodyTooLarge:
+            pass
+        if exceeded:
+            await self._reject(scope, receive, send)
+
+    async def _reject(self, scope, receive, send):
+        """Send the 413 response"""
+        response = JSONResponse(
+            {"detail": f"File exceeds the maximum upload size of {self.max_size // (1024 * 1024)} MB"},
+            status_code=413,
+            headers={"Connection": "close"}
+        )
+        await response(scope, receive, send)
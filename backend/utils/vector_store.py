@@ -3,14 +3,16 @@ import chromadb
 from chromadb.config import Settings
 from typing import List, Dict
 import uuid
-from sentence_transformers import SentenceTransformer
+from utils.embedding_backend import LocalEmbeddingBackend
+from utils.chunker import Chunk, TextChunker
 
 class VectorStore:
     def __init__(self):
         self.persist_directory = os.getenv("CHROMA_PERSIST_DIRECTORY", "./chroma_db")
         self.client = None
         self.collection = None
-        self.embedding_model = None
+        self.embedding_backend = LocalEmbeddingBackend()
+        self.chunker = TextChunker()
     
     async def initialize(self):
         """Initialize the vector store"""
@@ -30,9 +32,6 @@ class VectorStore:
                 metadata={"hnsw:space": "cosine"}
             )
             
-            # Initialize embedding model
-            self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-            
         except Exception as e:
             raise Exception(f"Error initializing vector store: {str(e)}")
     
@@ -41,21 +40,29 @@ class VectorStore:
         try:
             # Split content into chunks
             chunks = self._split_text(content)
+            if not chunks:
+                return
+            texts = [chunk.text for chunk in chunks]
             
-            # Generate embeddings and store
-            for i, chunk in enumerate(chunks):
-                chunk_id = f"{document_id}_{i}"
-                
-                self.collection.add(
-                    documents=[chunk],
-                    metadatas=[{
+            # Generate embeddings with the shared local model and store
+            embeddings = await self.embedding_backend.embed(texts)
+            
+            self.collection.add(
+                documents=texts,
+                embeddings=embeddings,
+                metadatas=[
+                    {
                         "document_id": document_id,
                         "filename": filename,
                         "chunk_index": i,
-                        "total_chunks": len(chunks)
-                    }],
-                    ids=[chunk_id]
-                )
+                        "total_chunks": len(chunks),
+                        "start_offset": chunk.start,
+                        "end_offset": chunk.end
+                    }
+                    for i, chunk in enumerate(chunks)
+                ],
+                ids=[f"{document_id}_{i}" for i in range(len(chunks))]
+            )
                 
         except Exception as e:
             raise Exception(f"Error adding document to vector store: {str(e)}")
@@ -63,8 +70,10 @@ class VectorStore:
     async def search(self, query: str, limit: int = 5) -> List[Dict]:
         """Search for relevant documents"""
         try:
+            query_embedding = (await self.embedding_backend.embed([query]))[0]
+            
             results = self.collection.query(
-                query_texts=[query],
+                query_embeddings=[query_embedding],
                 n_results=limit
             )
             
@@ -103,32 +112,9 @@ class VectorStore:
         except Exception as e:
             raise Exception(f"Error deleting document from vector store: {str(e)}")
     
-    def _split_text(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
+    def _split_text(self, text: str) -> List[Chunk]:
         """Split text into overlapping chunks"""
-        if len(text) <= chunk_size:
-            return [text]
-        
-        chunks = []
-        start = 0
-        
-        while start < len(text):
-            end = start + chunk_size
-            
-            # Try to break at sentence boundary
-            if end < len(text):
-                # Look for sentence endings
-                for i in range(end, max(start + chunk_size - 100, start), -1):
-                    if text[i] in '.!?':
-                        end = i + 1
-                        break
-            
-            chunk = text[start:end].strip()
-            if chunk:
-                chunks.append(chunk)
-            
-            start = end - overlap
-            
-        return chunks
+        return self.chunker.split(text)
     
     async def get_collection_stats(self) -> Dict:
         """Get statistics about the collection"""
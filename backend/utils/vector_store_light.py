@@ -1,124 +1,552 @@
 import os
-import chromadb
-from chromadb.config import Settings
-from typing import List, Dict
+from typing import List, Dict, Optional, Callable, Union
+from dataclasses import dataclass, field
+from datetime import datetime
+from bisect import bisect_right
 import uuid
-import openai
+import hashlib
+from utils.embedding_cache import EmbeddingCache
+from utils.bm25_index import BM25Index
+from utils.embedding_backend import EmbeddingBackend, get_embedding_backend
+from utils.chunker import Chunk, TextChunker
+from utils.executors import run_in_thread
+
+SEARCH_MODES = ("dense", "keyword", "hybrid")
+
+@dataclass
+class SearchResult:
+    """A stored chunk returned by a vector store search"""
+    chunk_id: str
+    document_id: str
+    filename: str
+    chunk_index: int
+    content: str
+    similarity: Optional[float] = None
+    score: Optional[float] = None
+    start_offset: Optional[int] = None
+    end_offset: Optional[int] = None
+    page: Optional[int] = None
+    neighbors: List["SearchResult"] = field(default_factory=list)
 
 class VectorStoreLight:
-    def __init__(self):
+    def __init__(self, embedding_backend: Optional[EmbeddingBackend] = None):
         self.persist_directory = os.getenv("CHROMA_PERSIST_DIRECTORY", "./chroma_db")
+        self.collection_name = os.getenv("CHROMA_COLLECTION", "documents")
         self.client = None
         self.collection = None
-        self.openai_client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.embedding_backend = embedding_backend or get_embedding_backend()
+        self.batch_size = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+        self.batch_token_budget = int(os.getenv("EMBEDDING_BATCH_TOKENS", "50000"))
+        self.embedding_cache = EmbeddingCache()
+        self.chunker = TextChunker()
+        self.keyword_index = BM25Index()
+        self.search_mode = os.getenv("SEARCH_MODE", "hybrid")
+        # Reciprocal rank fusion constant: larger values flatten the weight of top ranks
+        self.rrf_k = int(os.getenv("SEARCH_RRF_K", "60"))
     
     async def initialize(self):
         """Initialize the vector store"""
+        await run_in_thread(self._initialize)
+    
+    def _initialize(self):
+        """Open the chunk storage, embedding cache and keyword index (blocking)"""
         try:
-            # Initialize ChromaDB client
-            self.client = chromadb.PersistentClient(
-                path=self.persist_directory,
-                settings=Settings(
-                    anonymized_telemetry=False,
-                    allow_reset=True
-                )
-            )
-            
-            # Get or create collection
-            self.collection = self.client.get_or_create_collection(
-                name="documents",
-                metadata={"hnsw:space": "cosine"}
-            )
+            self._open()
+            self.embedding_cache.initialize()
+            self.keyword_index.initialize()
+            self._backfill_keyword_index()
             
         except Exception as e:
             raise Exception(f"Error initializing vector store: {str(e)}")
     
-    def _get_embedding(self, text: str) -> List[float]:
-        """Get embedding using OpenAI API"""
-        try:
-            response = self.openai_client.embeddings.create(
-                model="text-embedding-3-small",
-                input=text
+    def _open(self):
+        """Open the Chroma client and collection (blocking)"""
+        # Imported here so other storage backends don't pay for loading Chroma
+        import chromadb
+        from chromadb.config import Settings
+        
+        # Initialize ChromaDB client
+        self.client = chromadb.PersistentClient(
+            path=self.persist_directory,
+            settings=Settings(
+                anonymized_telemetry=False,
+                allow_reset=True
             )
-            return response.data[0].embedding
-        except Exception as e:
-            # Fallback to simple text representation
-            return [float(ord(c)) for c in text[:100]]  # Simple fallback
+        )
+        
+        # Get or create collection
+        self.collection = self.client.get_or_create_collection(
+            name=self.collection_name,
+            metadata={"hnsw:space": "cosine", "embedding_model": self.embedding_backend.name}
+        )
+        
+        # Vectors from different models cannot share a collection
+        collection_model = (self.collection.metadata or {}).get("embedding_model")
+        if collection_model and collection_model != self.embedding_backend.name:
+            raise ValueError(
+                f"Collection '{self.collection_name}' holds {collection_model} embeddings, "
+                f"not {self.embedding_backend.name}; set CHROMA_COLLECTION to use a new collection"
+            )
+    
+    def _count(self) -> int:
+        """Number of stored chunks (blocking)"""
+        return self.collection.count()
+    
+    def _max_batch_size(self) -> int:
+        """Most chunks the storage accepts in one write"""
+        return self.client.get_max_batch_size()
+    
+    def _get(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None,
+             include: Optional[List[str]] = None, limit: Optional[int] = None,
+             offset: Optional[int] = None) -> Dict:
+        """Stored chunks by id and/or metadata filter, in Chroma's result shape (blocking)"""
+        return self.collection.get(ids=ids, where=where, include=include or [], limit=limit, offset=offset)
+    
+    def _query(self, embedding: List[float], limit: int, where: Optional[Dict]) -> Dict:
+        """Stored chunks nearest to an embedding, in Chroma's result shape (blocking)"""
+        return self.collection.query(
+            query_embeddings=[embedding],
+            n_results=limit,
+            where=where,
+            include=["documents", "metadatas", "distances"]
+        )
+    
+    def _delete(self, ids: List[str]):
+        """Remove stored chunks (blocking)"""
+        self.collection.delete(ids=ids)
+    
+    def _backfill_keyword_index(self):
+        """Build the keyword index from stored chunks when it is missing (blocking)"""
+        if self.keyword_index.count() or not self._count():
+            return
+        
+        batch_size = self._max_batch_size()
+        offset = 0
+        while True:
+            results = self._get(
+                include=["documents", "metadatas"], limit=batch_size, offset=offset
+            )
+            if not results['ids']:
+                break
+            
+            by_document: Dict[str, tuple] = {}
+            for chunk_id, doc, metadata in zip(results['ids'], results['documents'], results['metadatas']):
+                ids, texts = by_document.setdefault(metadata["document_id"], ([], []))
+                ids.append(chunk_id)
+                texts.append(doc)
+            for document_id, (ids, texts) in by_document.items():
+                self.keyword_index.add(document_id, ids, texts)
+            
+            offset += len(results['ids'])
+    
+    async def embed_query(self, text: str) -> List[float]:
+        """Embed a query with the store's backend and cache"""
+        return await self._get_embedding(text)
+    
+    async def _get_embedding(self, text: str) -> List[float]:
+        """Get embedding for a single text"""
+        return (await self._get_embeddings([text]))[0]
+    
+    async def _get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Get embeddings for several texts, calling the backend only for cache misses"""
+        model = self.embedding_backend.name
+        embeddings = await run_in_thread(self.embedding_cache.get_many, model, texts)
+        
+        # Embed each distinct uncached text once
+        missing = list(dict.fromkeys(
+            text for text, embedding in zip(texts, embeddings) if embedding is None
+        ))
+        if not missing:
+            return embeddings
+        
+        fresh = await self.embedding_backend.embed(missing)
+        await run_in_thread(self.embedding_cache.put_many, model, missing, fresh)
+        
+        computed = dict(zip(missing, fresh))
+        return [
+            embedding if embedding is not None else computed[text]
+            for text, embedding in zip(texts, embeddings)
+        ]
+    
+    def _batch_chunks(self, chunks: List[str]) -> List[List[str]]:
+        """Group chunks into batches bounded by count and estimated tokens"""
+        batches = []
+        batch = []
+        batch_tokens = 0
+        
+        for chunk in chunks:
+            # Rough estimate of ~4 characters per token
+            tokens = len(chunk) // 4 + 1
+            if batch and (len(batch) >= self.batch_size or batch_tokens + tokens > self.batch_token_budget):
+                batches.append(batch)
+                batch = []
+                batch_tokens = 0
+            batch.append(chunk)
+            batch_tokens += tokens
+        
+        if batch:
+            batches.append(batch)
+        
+        return batches
     
-    async def add_document(self, document_id: str, content: str, filename: str):
-        """Add a document to the vector store"""
+    async def add_document(self, document_id: str, content: str, filename: str,
+                           upload_date: Optional[datetime] = None,
+                           page_offsets: Optional[List[int]] = None,
+                           progress_callback: Optional[Callable[[int, int, int], None]] = None):
+        """Add a document to the vector store, reporting (embedded, total) chunk progress"""
+        await self.update_document(
+            document_id, content, filename,
+            upload_date=upload_date, page_offsets=page_offsets,
+            progress_callback=progress_callback
+        )
+        return True
+    
+    async def update_document(self, document_id: str, content: str, filename: str,
+                              upload_date: Optional[datetime] = None,
+                              page_offsets: Optional[List[int]] = None,
+                              progress_callback: Optional[Callable[[int, int, int], None]] = None,
+                              source_id: Optional[str] = None) -> Dict[str, int]:
+        """(Re)index a document, embedding only chunks whose text is not already stored
+        
+        Chunks are reused from source_id when given (a copy of shared chunks), otherwise
+        from the document's own chunks, which are then pruned to the new content.
+        """
         try:
-            # Split content into chunks
-            chunks = self._split_text(content)
+            upload_ts = (upload_date or datetime.utcnow()).timestamp()
+            source_id = source_id or document_id
+            copying = source_id != document_id
+            
+            # Split content into chunks, keyed by their text
+            chunks = await run_in_thread(self._split_text, content)
+            keys = self._chunk_keys(chunks)
+            
+            existing = await run_in_thread(
+                self._get,
+                where={"document_id": source_id},
+                include=["embeddings"] if copying else []
+            )
+            existing_ids = {
+                self._chunk_key(source_id, chunk_id): chunk_id for chunk_id in existing['ids']
+            }
+            
+            metadatas = [
+                {
+                    "document_id": document_id,
+                    "filename": filename,
+                    "chunk_index": i,
+                    "chunk_hash": key.split("_")[0],
+                    "start_offset": chunk.start,
+                    "end_offset": chunk.end,
+                    "upload_ts": upload_ts
+                }
+                for i, (chunk, key) in enumerate(zip(chunks, keys))
+            ]
+            if page_offsets:
+                # 1-based page on which each chunk starts
+                for chunk, metadata in zip(chunks, metadatas):
+                    metadata["page"] = bisect_right(page_offsets, chunk.start)
+            
+            wanted = set(keys)
+            fresh = [i for i, key in enumerate(keys) if key not in existing_ids]
+            reused = [i for i, key in enumerate(keys) if key in existing_ids]
+            stale = [] if copying else [
+                chunk_id for key, chunk_id in existing_ids.items() if key not in wanted
+            ]
             
-            # Generate embeddings and store
-            for i, chunk in enumerate(chunks):
-                chunk_id = f"{document_id}_{i}"
-                embedding = self._get_embedding(chunk)
+            # Generate embeddings batch by batch, for new text only;
+            # progress is (embedded so far, all chunks, reused without embedding)
+            embeddings = []
+            fresh_texts = [chunks[i].text for i in fresh]
+            if progress_callback:
+                progress_callback(0, len(chunks), len(reused))
+            for batch in self._batch_chunks(fresh_texts):
+                embeddings.extend(await self._get_embeddings(batch))
                 
-                self.collection.add(
-                    documents=[chunk],
-                    embeddings=[embedding],
-                    metadatas=[{
-                        "document_id": document_id,
-                        "filename": filename,
-                        "chunk_index": i
-                    }],
-                    ids=[chunk_id]
+                if progress_callback:
+                    progress_callback(len(embeddings), len(chunks), len(reused))
+            
+            ids = [f"{document_id}_{key}" for key in keys]
+            await run_in_thread(
+                self._write_chunks,
+                [ids[i] for i in fresh], fresh_texts, embeddings, [metadatas[i] for i in fresh]
+            )
+            
+            if copying and reused:
+                # Copy the stored vectors of unchanged chunks under the new document
+                stored = dict(zip(existing['ids'], existing['embeddings']))
+                await run_in_thread(
+                    self._write_chunks,
+                    [ids[i] for i in reused], [chunks[i].text for i in reused],
+                    [stored[existing_ids[keys[i]]] for i in reused], [metadatas[i] for i in reused]
+                )
+            elif reused:
+                # Same text, possibly new position: refresh metadata only
+                await run_in_thread(
+                    self._update_chunk_metadata, [ids[i] for i in reused], [metadatas[i] for i in reused]
                 )
             
-            return True
+            # Unchanged chunks of the same document keep their ids and postings
+            indexed = fresh + reused if copying else fresh
+            await run_in_thread(
+                self.keyword_index.add, document_id,
+                [ids[i] for i in indexed], [chunks[i].text for i in indexed]
+            )
+            
+            if stale:
+                await run_in_thread(self._delete, stale)
+                await run_in_thread(self.keyword_index.delete, stale)
+            
+            return {
+                "chunks_total": len(chunks),
+                "chunks_embedded": len(fresh),
+                "chunks_reused": len(reused),
+                "chunks_deleted": len(stale)
+            }
             
         except Exception as e:
-            raise Exception(f"Error adding document to vector store: {str(e)}")
+            raise Exception(f"Error indexing document in vector store: {str(e)}")
+    
+    @staticmethod
+    def _chunk_keys(chunks: List[Chunk]) -> List[str]:
+        """Content-addressed chunk keys: text hash plus an occurrence number for repeated text"""
+        keys = []
+        seen: Dict[str, int] = {}
+        for chunk in chunks:
+            digest = hashlib.sha256(chunk.text.encode("utf-8")).hexdigest()[:16]
+            occurrence = seen.get(digest, 0)
+            seen[digest] = occurrence + 1
+            keys.append(digest if occurrence == 0 else f"{digest}_{occurrence}")
+        return keys
+    
+    @staticmethod
+    def _chunk_key(document_id: str, chunk_id: str) -> str:
+        """Strip the document prefix from a chunk id"""
+        return chunk_id[len(document_id) + 1:]
     
-    async def search_similar(self, query: str, limit: int = 5) -> List[Dict]:
-        """Search for similar documents"""
+    def _update_chunk_metadata(self, ids: List[str], metadatas: List[Dict]):
+        """Rewrite metadata of stored chunks, split past Chroma's batch limit (blocking)"""
+        max_batch = self._max_batch_size()
+        for start in range(0, len(ids), max_batch):
+            end = start + max_batch
+            self.collection.update(ids=ids[start:end], metadatas=metadatas[start:end])
+    
+    def _write_chunks(self, ids: List[str], texts: List[str],
+                      embeddings: List[List[float]], metadatas: List[Dict]):
+        """Store chunks in one write, split only past Chroma's batch limit (blocking)"""
+        max_batch = self._max_batch_size()
+        for start in range(0, len(ids), max_batch):
+            end = start + max_batch
+            self.collection.add(
+                documents=texts[start:end],
+                embeddings=embeddings[start:end],
+                metadatas=metadatas[start:end],
+                ids=ids[start:end]
+            )
+    
+    async def search(self, query: str, limit: int = 5,
+                     min_similarity: Optional[float] = None,
+                     document_id: Optional[Union[str, List[str]]] = None,
+                     filename: Optional[str] = None,
+                     uploaded_after: Optional[datetime] = None,
+                     uploaded_before: Optional[datetime] = None,
+                     include_neighbors: bool = False,
+                     mode: Optional[str] = None) -> List[SearchResult]:
+        """Search for the chunks best matching a query
+        
+        Modes: "dense" (embedding similarity), "keyword" (BM25, no embedding call) or
+        "hybrid" (both, merged by reciprocal rank fusion). min_similarity applies to dense hits.
+        """
         try:
-            query_embedding = self._get_embedding(query)
+            mode = mode or self.search_mode
+            if mode not in SEARCH_MODES:
+                raise ValueError(f"Unknown search mode '{mode}', expected one of {', '.join(SEARCH_MODES)}")
             
-            results = self.collection.query(
-                query_embeddings=[query_embedding],
-                n_results=limit
-            )
+            where = self._build_where(document_id, filename, uploaded_after, uploaded_before)
+            document_ids = [document_id] if isinstance(document_id, str) else document_id
+            # Filters beyond the document id are applied after the keyword lookup
+            post_filtered = bool(filename or uploaded_after or uploaded_before)
             
-            similar_docs = []
-            if results['documents'] and results['documents'][0]:
-                for i, doc in enumerate(results['documents'][0]):
-                    similar_docs.append({
-                        "content": doc,
-                        "metadata": results['metadatas'][0][i] if results['metadatas'] else {},
-                        "distance": results['distances'][0][i] if results['distances'] else 0
-                    })
+            if mode == "dense":
+                matches = await self._dense_search(query, limit, where, min_similarity)
+            elif mode == "keyword":
+                matches = await run_in_thread(
+                    self._keyword_search, query, limit, document_ids, where, post_filtered
+                )
+            else:
+                candidates = max(limit * 4, 20)
+                dense = await self._dense_search(query, candidates, where, min_similarity)
+                keyword = await run_in_thread(
+                    self._keyword_search, query, candidates, document_ids, where, post_filtered
+                )
+                matches = self._fuse([dense, keyword], limit)
+            
+            if include_neighbors and matches:
+                await run_in_thread(self._attach_neighbors, matches)
             
-            return similar_docs
+            return matches
             
         except Exception as e:
             raise Exception(f"Error searching vector store: {str(e)}")
     
-    def _split_text(self, text: str, chunk_size: int = 1000) -> List[str]:
-        """Split text into chunks"""
-        words = text.split()
-        chunks = []
+    async def _dense_search(self, query: str, limit: int, where: Optional[Dict],
+                            min_similarity: Optional[float]) -> List[SearchResult]:
+        """Nearest chunks by embedding similarity"""
+        if await run_in_thread(self._count) == 0:
+            return []
+        
+        query_embedding = await self._get_embedding(query)
         
-        for i in range(0, len(words), chunk_size):
-            chunk = " ".join(words[i:i + chunk_size])
-            chunks.append(chunk)
+        results = await run_in_thread(self._query, query_embedding, limit, where)
         
-        return chunks
+        matches = []
+        if results['documents'] and results['documents'][0]:
+            for i, doc in enumerate(results['documents'][0]):
+                # Cosine distance to similarity
+                similarity = 1 - results['distances'][0][i]
+                if min_similarity is not None and similarity < min_similarity:
+                    continue
+                matches.append(self._to_result(results['ids'][0][i], doc, results['metadatas'][0][i], similarity))
+        return matches
+    
+    def _keyword_search(self, query: str, limit: int, document_ids: Optional[List[str]],
+                        where: Optional[Dict], post_filtered: bool) -> List[SearchResult]:
+        """Best BM25 matches, fetched from the collection by id (blocking)"""
+        # Over-fetch when filters may drop candidates after scoring
+        ranked = self.keyword_index.search(
+            query, limit * 4 if post_filtered else limit, document_ids=document_ids
+        )
+        if not ranked:
+            return []
+        
+        scores = dict(ranked)
+        results = self._get(
+            ids=list(scores), where=where, include=["documents", "metadatas"]
+        )
+        matches = [
+            self._to_result(chunk_id, doc, metadata, None)
+            for chunk_id, doc, metadata in zip(results['ids'], results['documents'], results['metadatas'])
+        ]
+        for match in matches:
+            match.score = scores[match.chunk_id]
+        matches.sort(key=lambda match: match.score, reverse=True)
+        return matches[:limit]
+    
+    def _fuse(self, rankings: List[List[SearchResult]], limit: int) -> List[SearchResult]:
+        """Merge ranked lists by reciprocal rank fusion"""
+        fused: Dict[str, SearchResult] = {}
+        scores: Dict[str, float] = {}
+        for ranking in rankings:
+            for rank, result in enumerate(ranking):
+                # The first list to return a chunk supplies its result (dense keeps its similarity)
+                fused.setdefault(result.chunk_id, result)
+                scores[result.chunk_id] = scores.get(result.chunk_id, 0.0) + 1 / (self.rrf_k + rank + 1)
+        
+        ranked = sorted(fused.values(), key=lambda result: scores[result.chunk_id], reverse=True)[:limit]
+        for result in ranked:
+            result.score = scores[result.chunk_id]
+        return ranked
+    
+    def _build_where(self, document_id: Optional[Union[str, List[str]]], filename: Optional[str],
+                     uploaded_after: Optional[datetime], uploaded_before: Optional[datetime]) -> Optional[Dict]:
+        """Translate search filters into a Chroma where clause"""
+        conditions = []
+        
+        if isinstance(document_id, str):
+            conditions.append({"document_id": document_id})
+        elif document_id:
+            conditions.append({"document_id": {"$in": list(document_id)}})
+        if filename:
+            conditions.append({"filename": filename})
+        if uploaded_after:
+            conditions.append({"upload_ts": {"$gte": uploaded_after.timestamp()}})
+        if uploaded_before:
+            conditions.append({"upload_ts": {"$lte": uploaded_before.timestamp()}})
+        
+        if not conditions:
+            return None
+        if len(conditions) == 1:
+            return conditions[0]
+        return {"$and": conditions}
+    
+    def _to_result(self, chunk_id: str, content: str, metadata: Dict, similarity: Optional[float]) -> SearchResult:
+        """Build a search result from a stored chunk"""
+        return SearchResult(
+            chunk_id=chunk_id,
+            document_id=metadata["document_id"],
+            filename=metadata.get("filename", ""),
+            chunk_index=metadata.get("chunk_index", 0),
+            content=content,
+            similarity=similarity,
+            start_offset=metadata.get("start_offset"),
+            end_offset=metadata.get("end_offset"),
+            page=metadata.get("page")
+        )
+    
+    def _attach_neighbors(self, matches: List[SearchResult]):
+        """Fetch the chunks on either side of each match, one query per document (blocking)"""
+        wanted: Dict[str, set] = {}
+        for match in matches:
+            wanted.setdefault(match.document_id, set()).update(
+                index for index in (match.chunk_index - 1, match.chunk_index + 1) if index >= 0
+            )
+        
+        chunks: Dict[tuple, SearchResult] = {}
+        for document_id, indexes in wanted.items():
+            results = self._get(
+                where={"$and": [
+                    {"document_id": document_id},
+                    {"chunk_index": {"$in": sorted(indexes)}}
+                ]},
+                include=["documents", "metadatas"]
+            )
+            for chunk_id, doc, metadata in zip(results['ids'], results['documents'], results['metadatas']):
+                chunks[(document_id, metadata["chunk_index"])] = self._to_result(chunk_id, doc, metadata, None)
+        
+        for match in matches:
+            match.neighbors = [
+                chunks[key]
+                for key in ((match.document_id, match.chunk_index - 1), (match.document_id, match.chunk_index + 1))
+                if key in chunks
+            ]
+    
+    def _split_text(self, text: str) -> List[Chunk]:
+        """Split text into chunks"""
+        return self.chunker.split(text)
+    
+    def close(self):
+        """Close the embedding cache and keyword index"""
+        self.embedding_cache.close()
+        self.keyword_index.close()
     
     async def delete_document(self, document_id: str):
         """Delete a document from the vector store"""
         try:
             # Get all chunks for this document
-            results = self.collection.get(
-                where={"document_id": document_id}
+            results = await run_in_thread(
+                self._get,
+                where={"document_id": document_id},
+                include=[]
             )
             
             if results['ids']:
-                self.collection.delete(ids=results['ids'])
+                await run_in_thread(self._delete, results['ids'])
+            await run_in_thread(self.keyword_index.delete_document, document_id)
             
             return True
             
         except Exception as e:
             raise Exception(f"Error deleting document from vector store: {str(e)}")
+
+def get_vector_store(embedding_backend: Optional[EmbeddingBackend] = None,
+                     store: Optional[str] = None) -> VectorStoreLight:
+    """Create the vector store selected by VECTOR_STORE (chroma or numpy)"""
+    store = (store or os.getenv("VECTOR_STORE", "chroma")).lower()
+
+    if store == "chroma":
+        return VectorStoreLight(embedding_backend=embedding_backend)
+    if store == "numpy":
+        # Imported here, the NumPy store builds on this module
+        from utils.vector_store_numpy import NumpyVectorStore
+        return NumpyVectorStore(embedding_backend=embedding_backend)
+
+    raise ValueError(f"Unknown vector store: {store}")
@@ -0,0 +1,451 @@
+import os
+import glob
+import zlib
+import sqlite3
+import threading
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from utils.embedding_backend import EmbeddingBackend
+from utils.vector_store_light import VectorStoreLight
+
+# Metadata stored per chunk, in column order
+_METADATA_COLUMNS = ("document_id", "filename", "chunk_index", "chunk_hash",
+                     "start_offset", "end_offset", "upload_ts", "page")
+
+# Filterable fields held in memory; string fields are dictionary-encoded
+_CODED_FIELDS = ("document_id", "filename")
+_NUMERIC_FIELDS = ("chunk_index", "upload_ts")
+
+class NumpyVectorStore(VectorStoreLight):
+    """In-process vector store: normalized float32 embeddings in a memory-mapped matrix, metadata in SQLite
+
+    Search is an exact cosine scan (one matrix-vector product) with argpartition top-k.
+    Deleted rows are tombstoned and reclaimed by compaction once they make up
+    NUMPY_COMPACT_RATIO of the matrix.
+    """
+
+    def __init__(self, embedding_backend: Optional[EmbeddingBackend] = None):
+        super().__init__(embedding_backend=embedding_backend)
+        self.persist_directory = os.getenv("NUMPY_STORE_DIRECTORY", "./numpy_store")
+        self.compact_ratio = float(os.getenv("NUMPY_COMPACT_RATIO", "0.25"))
+        self.compression_level = int(os.getenv("TEXT_COMPRESSION_LEVEL", "6"))
+        self._lock = threading.RLock()
+        self._conn = None
+        self._matrix: Optional[np.memmap] = None
+        self._dim: Optional[int] = None
+        self._generation = 0
+        # Rows in use, live or tombstoned; row -> chunk id (None once deleted)
+        self._rows = 0
+        self._live = 0
+        self._ids: List[Optional[str]] = []
+        self._row_of: Dict[str, int] = {}
+        self._alive = np.zeros(0, dtype=bool)
+        self._columns: Dict[str, np.ndarray] = {
+            "document_id": np.zeros(0, dtype=np.int32),
+            "filename": np.zeros(0, dtype=np.int32),
+            "chunk_index": np.zeros(0, dtype=np.int32),
+            "upload_ts": np.zeros(0, dtype=np.float64)
+        }
+        self._codes: Dict[str, Dict[str, int]] = {field: {} for field in _CODED_FIELDS}
+
+    def _open(self):
+        """Open the metadata database and the embedding matrix (blocking)"""
+        os.makedirs(self.persist_directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(
+            os.path.join(self.persist_directory, "chunks.db"), check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "row INTEGER PRIMARY KEY, chunk_id TEXT NOT NULL UNIQUE, document_id TEXT NOT NULL, "
+            "filename TEXT, chunk_index INTEGER, chunk_hash TEXT, start_offset INTEGER, "
+            "end_offset INTEGER, upload_ts REAL, page INTEGER, content BLOB NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_chunks_document_id ON chunks (document_id)")
+        self._conn.commit()
+
+        meta = dict(self._conn.execute("SELECT key, value FROM meta").fetchall())
+
+        # Vectors from different models cannot share a store
+        store_model = meta.get("embedding_model")
+        if store_model and store_model != self.embedding_backend.name:
+            raise ValueError(
+                f"Store '{self.persist_directory}' holds {store_model} embeddings, "
+                f"not {self.embedding_backend.name}; set NUMPY_STORE_DIRECTORY to use a new store"
+            )
+        if not store_model:
+            self._set_meta("embedding_model", self.embedding_backend.name)
+            self._conn.commit()
+
+        self._dim = int(meta["dim"]) if "dim" in meta else None
+        self._generation = int(meta.get("generation", "0"))
+
+        # Matrices of other generations are leftovers of an interrupted compaction
+        current = self._matrix_path(self._generation)
+        for path in glob.glob(os.path.join(self.persist_directory, "vectors-*.f32")):
+            if path != current:
+                os.remove(path)
+
+        rows = self._conn.execute(
+            "SELECT row, chunk_id, document_id, filename, chunk_index, upload_ts FROM chunks ORDER BY row"
+        ).fetchall()
+        self._rows = rows[-1][0] + 1 if rows else 0
+        if self._dim is not None:
+            self._ensure_capacity(self._rows)
+
+        self._ids = [None] * self._rows
+        self._load_rows(rows)
+
+    def _load_rows(self, rows: List[tuple]):
+        """Fill the in-memory id map and filter columns from stored rows, column at a time"""
+        if not rows:
+            return
+
+        index = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        for row, chunk_id in zip(index.tolist(), (row[1] for row in rows)):
+            self._ids[row] = chunk_id
+        self._row_of = {row[1]: row[0] for row in rows}
+        self._alive[index] = True
+        self._live = len(rows)
+
+        for position, field in enumerate(_CODED_FIELDS, start=2):
+            codes = self._codes[field]
+            self._columns[field][index] = np.fromiter(
+                (codes.setdefault(row[position] or "", len(codes)) for row in rows),
+                dtype=np.int32, count=len(rows)
+            )
+        for position, field in enumerate(_NUMERIC_FIELDS, start=4):
+            column = self._columns[field]
+            self._columns[field][index] = np.fromiter(
+                (-1 if row[position] is None else row[position] for row in rows),
+                dtype=column.dtype, count=len(rows)
+            )
+
+    def _matrix_path(self, generation: int) -> str:
+        """File holding the embedding matrix of a compaction generation"""
+        return os.path.join(self.persist_directory, f"vectors-{generation}.f32")
+
+    def _set_meta(self, key: str, value):
+        """Record a store-level setting (caller commits)"""
+        self._conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value))
+        )
+
+    def _ensure_capacity(self, rows: int):
+        """Grow the matrix file and in-memory columns to hold at least this many rows (lock held)"""
+        capacity = len(self._alive)
+        if self._matrix is not None and rows <= capacity:
+            return
+
+        path = self._matrix_path(self._generation)
+        if os.path.exists(path):
+            capacity = max(capacity, os.path.getsize(path) // (self._dim * 4))
+        if rows > capacity:
+            # Double to keep appends amortized
+            capacity = max(rows, capacity * 2, 1024)
+
+        if self._matrix is not None:
+            self._matrix.flush()
+            self._matrix = None
+        with open(path, "ab") as f:
+            f.truncate(capacity * self._dim * 4)
+        self._matrix = np.memmap(path, dtype=np.float32, mode="r+", shape=(capacity, self._dim))
+
+        grow = capacity - len(self._alive)
+        if grow > 0:
+            self._alive = np.concatenate([self._alive, np.zeros(grow, dtype=bool)])
+            for field, column in self._columns.items():
+                fill = np.full(grow, -1, dtype=column.dtype)
+                self._columns[field] = np.concatenate([column, fill])
+
+    def _set_row(self, row: int, chunk_id: str, metadata: Dict):
+        """Record a stored chunk in the in-memory id map and filter columns (lock held)"""
+        if not self._alive[row]:
+            self._live += 1
+        self._alive[row] = True
+        self._ids[row] = chunk_id
+        self._row_of[chunk_id] = row
+        for field in _CODED_FIELDS:
+            codes = self._codes[field]
+            value = metadata.get(field) or ""
+            self._columns[field][row] = codes.setdefault(value, len(codes))
+        for field in _NUMERIC_FIELDS:
+            value = metadata.get(field)
+            self._columns[field][row] = -1 if value is None else value
+
+    def _count(self) -> int:
+        """Number of stored chunks"""
+        return self._live
+
+    def _max_batch_size(self) -> int:
+        """Most chunks written in one transaction"""
+        return 4096
+
+    def _write_chunks(self, ids: List[str], texts: List[str],
+                      embeddings: List[List[float]], metadatas: List[Dict]):
+        """Store chunks, appending new ids and overwriting existing ones in place (blocking)"""
+        if not ids:
+            return
+
+        vectors = self._normalize(np.asarray(embeddings, dtype=np.float32))
+
+        with self._lock:
+            if self._dim is None:
+                self._dim = vectors.shape[1]
+                self._set_meta("dim", self._dim)
+            elif vectors.shape[1] != self._dim:
+                raise ValueError(f"Embedding has {vectors.shape[1]} dimensions, the store holds {self._dim}")
+
+            rows = []
+            for chunk_id in ids:
+                row = self._row_of.get(chunk_id)
+                if row is None:
+                    row = self._rows
+                    self._rows += 1
+                    self._ids.append(None)
+                rows.append(row)
+            self._ensure_capacity(self._rows)
+
+            # Vectors are flushed before the rows referencing them are committed
+            self._matrix[rows] = vectors
+            self._matrix.flush()
+
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (row, chunk_id, content, "
+                f"{', '.join(_METADATA_COLUMNS)}) VALUES (?, ?, ?, {', '.join('?' * len(_METADATA_COLUMNS))})",
+                [
+                    (row, chunk_id, zlib.compress(text.encode("utf-8"), self.compression_level),
+                     *(metadata.get(column) for column in _METADATA_COLUMNS))
+                    for row, chunk_id, text, metadata in zip(rows, ids, texts, metadatas)
+                ]
+            )
+            self._conn.commit()
+
+            for row, chunk_id, metadata in zip(rows, ids, metadatas):
+                self._set_row(row, chunk_id, metadata)
+
+    def _update_chunk_metadata(self, ids: List[str], metadatas: List[Dict]):
+        """Rewrite metadata of stored chunks (blocking)"""
+        with self._lock:
+            self._conn.executemany(
+                f"UPDATE chunks SET {', '.join(f'{column} = ?' for column in _METADATA_COLUMNS)} "
+                "WHERE chunk_id = ?",
+                [
+                    (*(metadata.get(column) for column in _METADATA_COLUMNS), chunk_id)
+                    for chunk_id, metadata in zip(ids, metadatas)
+                ]
+            )
+            self._conn.commit()
+
+            for chunk_id, metadata in zip(ids, metadatas):
+                row = self._row_of.get(chunk_id)
+                if row is not None:
+                    self._set_row(row, chunk_id, metadata)
+
+    def _delete(self, ids: List[str]):
+        """Tombstone chunks, compacting once enough rows are dead (blocking)"""
+        with self._lock:
+            rows = [self._row_of.pop(chunk_id) for chunk_id in ids if chunk_id in self._row_of]
+            if not rows:
+                return
+
+            for start in range(0, len(rows), 500):
+                batch = rows[start:start + 500]
+                self._conn.execute(
+                    f"DELETE FROM chunks WHERE row IN ({','.join('?' * len(batch))})", batch
+                )
+            self._conn.commit()
+
+            self._alive[rows] = False
+            for row in rows:
+                self._ids[row] = None
+            self._live -= len(rows)
+
+            if self._rows - self._live >= max(self.compact_ratio * self._rows, 1):
+                self._compact()
+
+    def _compact(self):
+        """Rewrite the matrix without tombstoned rows, as a new generation (lock held)"""
+        live_rows = np.flatnonzero(self._alive[:self._rows])
+        generation = self._generation + 1
+        capacity = max(len(live_rows) * 5 // 4, 1024)
+
+        matrix = np.memmap(
+            self._matrix_path(generation), dtype=np.float32, mode="w+", shape=(capacity, self._dim)
+        )
+        for start in range(0, len(live_rows), 65536):
+            batch = live_rows[start:start + 65536]
+            matrix[start:start + len(batch)] = self._matrix[batch]
+        matrix.flush()
+
+        # Renumbering in ascending order never collides with a row not yet moved
+        self._conn.executemany(
+            "UPDATE chunks SET row = ? WHERE row = ?",
+            [(new, int(old)) for new, old in enumerate(live_rows) if new != old]
+        )
+        self._set_meta("generation", generation)
+        self._conn.commit()
+
+        old_path = self._matrix_path(self._generation)
+        self._matrix = matrix
+        self._generation = generation
+        os.remove(old_path)
+
+        self._ids = [self._ids[row] for row in live_rows]
+        self._row_of = {chunk_id: row for row, chunk_id in enumerate(self._ids)}
+        self._rows = self._live = len(live_rows)
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._alive[:self._rows] = True
+        for field, column in self._columns.items():
+            compacted = np.full(capacity, -1, dtype=column.dtype)
+            compacted[:self._rows] = column[live_rows]
+            self._columns[field] = compacted
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        """Scale rows to unit length so dot products are cosine similarities"""
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _mask(self, where: Optional[Dict], rows: int) -> Optional[np.ndarray]:
+        """Evaluate a Chroma-style where clause over the in-memory columns (lock held)"""
+        if not where:
+            return None
+
+        if "$and" in where:
+            mask = np.ones(rows, dtype=bool)
+            for condition in where["$and"]:
+                mask &= self._mask(condition, rows)
+            return mask
+
+        (field, condition), = where.items()
+        if field not in self._columns:
+            raise ValueError(f"Unsupported filter field: {field}")
+        column = self._columns[field][:rows]
+
+        if not isinstance(condition, dict):
+            return column == self._encode(field, [condition])[0]
+
+        (operator, value), = condition.items()
+        if operator == "$in":
+            return np.isin(column, self._encode(field, value))
+        if operator == "$gte":
+            return column >= value
+        if operator == "$lte":
+            return column <= value
+        raise ValueError(f"Unsupported filter operator: {operator}")
+
+    def _encode(self, field: str, values: List) -> List:
+        """Map filter values to column values (unknown strings match nothing)"""
+        if field not in _CODED_FIELDS:
+            return list(values)
+        codes = self._codes[field]
+        return [codes.get(value, -2) for value in values]
+
+    def _get(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None,
+             include: Optional[List[str]] = None, limit: Optional[int] = None,
+             offset: Optional[int] = None) -> Dict:
+        """Stored chunks by id and/or metadata filter, in Chroma's result shape (blocking)"""
+        include = include or []
+        with self._lock:
+            if ids is not None:
+                rows = np.array([self._row_of[chunk_id] for chunk_id in ids if chunk_id in self._row_of], dtype=np.int64)
+            else:
+                rows = np.flatnonzero(self._alive[:self._rows])
+
+            mask = self._mask(where, self._rows)
+            if mask is not None:
+                rows = rows[mask[rows]]
+            rows = rows[offset or 0:]
+            if limit is not None:
+                rows = rows[:limit]
+
+            chunk_ids = [self._ids[row] for row in rows]
+            results: Dict = {"ids": chunk_ids}
+            if "embeddings" in include:
+                results["embeddings"] = np.array(self._matrix[rows]) if len(rows) else []
+
+        if "documents" in include or "metadatas" in include:
+            records = self._fetch(chunk_ids)
+            results["documents"] = [records[chunk_id][0] for chunk_id in chunk_ids]
+            results["metadatas"] = [records[chunk_id][1] for chunk_id in chunk_ids]
+        return results
+
+    def _query(self, embedding: List[float], limit: int, where: Optional[Dict]) -> Dict:
+        """Exact cosine top-k over the matrix, in Chroma's result shape (blocking)"""
+        query = self._normalize(np.asarray(embedding, dtype=np.float32))[0]
+
+        # Snapshot under the lock; the scan itself runs unlocked (numpy releases the GIL)
+        with self._lock:
+            rows = self._rows
+            matrix = self._matrix
+            ids = self._ids
+            candidates = self._alive[:rows].copy()
+            mask = self._mask(where, rows)
+        if mask is not None:
+            candidates &= mask
+
+        empty = {"ids": [[]], "documents": [[]], "metadatas": [[]], "distances": [[]]}
+        if matrix is None or not candidates.any():
+            return empty
+
+        candidate_rows = np.flatnonzero(candidates)
+        if len(candidate_rows) < rows // 4:
+            # Selective filter: gather the few candidate rows instead of scanning all
+            scores = matrix[candidate_rows] @ query
+        else:
+            scores = np.asarray(matrix[:rows] @ query)[candidate_rows]
+
+        k = min(limit, len(candidate_rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        hits = [
+            (ids[row], float(score))
+            for row, score in zip(candidate_rows[top], scores[top])
+            if ids[row] is not None
+        ]
+        records = self._fetch([chunk_id for chunk_id, _ in hits])
+        hits = [(chunk_id, score) for chunk_id, score in hits if chunk_id in records]
+        return {
+            "ids": [[chunk_id for chunk_id, _ in hits]],
+            "documents": [[records[chunk_id][0] for chunk_id, _ in hits]],
+            "metadatas": [[records[chunk_id][1] for chunk_id, _ in hits]],
+            "distances": [[1 - score for _, score in hits]]
+        }
+
+    def _fetch(self, chunk_ids: List[str]) -> Dict[str, Tuple[str, Dict]]:
+        """Content and metadata of stored chunks, keyed by chunk id (blocking)"""
+        records = {}
+        with self._lock:
+            for start in range(0, len(chunk_ids), 500):
+                batch = chunk_ids[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT chunk_id, content, {', '.join(_METADATA_COLUMNS)} FROM chunks "
+                    f"WHERE chunk_id IN ({','.join('?' * len(batch))})",
+                    batch
+                ).fetchall()
+                for chunk_id, content, *values in rows:
+                    metadata = {
+                        column: value for column, value in zip(_METADATA_COLUMNS, values)
+                        if value is not None
+                    }
+                    records[chunk_id] = (zlib.decompress(content).decode("utf-8"), metadata)
+        return records
+
+    def close(self):
+        """Flush the matrix and close the metadata database"""
+        super().close()
+        with self._lock:
+            if self._matrix is not None:
+                self._matrix.flush()
+                self._matrix = None
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
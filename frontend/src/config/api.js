@@ -7,6 +7,7 @@ export const API_ENDPOINTS = {
   UPLOAD: `${API_BASE_URL}/upload`,
   DOCUMENT_CONTENT: (id) => `${API_BASE_URL}/documents/${id}/content`,
   DELETE_DOCUMENT: (id) => `${API_BASE_URL}/documents/${id}`,
+  DOCUMENT_STATUS: (id) => `${API_BASE_URL}/documents/${id}/status`,
   
   // Chat endpoints
   CHAT: `${API_BASE_URL}/chat`,
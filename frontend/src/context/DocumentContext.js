@@ -4,6 +4,9 @@ import { API_ENDPOINTS } from '../config/api';
 
 const DocumentContext = createContext();
 
+const STATUS_POLL_INTERVAL = 1500;
+const DOCUMENTS_PAGE_SIZE = 1000;
+
 const initialState = {
   documents: [],
   loading: false,
@@ -43,20 +46,55 @@ export const DocumentProvider = ({ children }) => {
   const fetchDocuments = async () => {
     try {
       dispatch({ type: 'SET_LOADING', payload: true });
-      const response = await fetch(API_ENDPOINTS.DOCUMENTS);
       
-      if (!response.ok) {
-        throw new Error('Failed to fetch documents');
-      }
+      // The API returns documents a page at a time; follow next_cursor to the end
+      const documents = [];
+      let cursor = null;
+      do {
+        const params = new URLSearchParams({ limit: DOCUMENTS_PAGE_SIZE });
+        if (cursor) {
+          params.set('cursor', cursor);
+        }
+        const response = await fetch(`${API_ENDPOINTS.DOCUMENTS}?${params}`);
+        
+        if (!response.ok) {
+          throw new Error('Failed to fetch documents');
+        }
+        
+        const data = await response.json();
+        documents.push(...data.documents);
+        cursor = data.next_cursor;
+      } while (cursor);
       
-      const data = await response.json();
-      dispatch({ type: 'SET_DOCUMENTS', payload: data.documents });
+      dispatch({ type: 'SET_DOCUMENTS', payload: documents });
     } catch (error) {
       dispatch({ type: 'SET_ERROR', payload: error.message });
       toast.error('Failed to load documents');
     }
   };
 
+  // Follow background processing until the document is completed or failed
+  const pollDocumentStatus = async (documentId) => {
+    try {
+      const response = await fetch(API_ENDPOINTS.DOCUMENT_STATUS(documentId));
+      
+      if (!response.ok) {
+        return;
+      }
+      
+      const status = await response.json();
+      dispatch({ type: 'UPDATE_DOCUMENT', payload: { id: documentId, updates: { processed: status.processed } } });
+      
+      if (status.processed === 'pending' || status.processed === 'processing') {
+        setTimeout(() => pollDocumentStatus(documentId), STATUS_POLL_INTERVAL);
+      } else if (status.processed === 'failed') {
+        toast.error(`Processing failed: ${status.error || 'unknown error'}`);
+      }
+    } catch (error) {
+      setTimeout(() => pollDocumentStatus(documentId), STATUS_POLL_INTERVAL);
+    }
+  };
+
   const uploadDocument = async (file) => {
     try {
       const formData = new FormData();
@@ -81,10 +119,13 @@ export const DocumentProvider = ({ children }) => {
         file_type: file.type,
         file_size: file.size,
         upload_date: new Date().toISOString(),
-        processed: 'completed'
+        processed: result.processed
       };
       
       dispatch({ type: 'ADD_DOCUMENT', payload: newDocument });
+      if (result.processed === 'pending' || result.processed === 'processing') {
+        pollDocumentStatus(result.document_id);
+      }
       return result;
     } catch (error) {
       toast.error(`Upload failed: ${error.message}`);